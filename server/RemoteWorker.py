@@ -11,7 +11,7 @@ import yaml
 from server.ServerWorker import get_source_by_mac_address
 from server.debug_print import debug_print
 from server.sqlDatabase import Database
-from server.utils import SocketIORedirect, dashboard_room, get_ip_addresses, get_upload_id, pbar_thread
+from server.utils import SocketIORedirect, dashboard_room, delete_remote_entries, get_ip_addresses, get_upload_id, pbar_thread, store_remote_entries
 
 class RemoteWorker:
     """
@@ -91,17 +91,17 @@ class RemoteWorker:
         if keys:
             self.redis.delete(*keys)
 
+    # all remote entries of a source are in the hash "remote_entries:{source}", keyed by upload_id
+    # and indexed by date, see store_remote_entries
     def create_remote_entry(self, source, upload_id, entry):
-        entry_json = json.dumps(entry)
-        self.redis.set(f'remote_entries:{source}:{upload_id}', entry_json)
+        store_remote_entries(self.redis, source, {upload_id: entry})
+
+    def create_remote_entries(self, source, entries):
+        # pipelined, in batches, entries is {upload_id: entry}
+        store_remote_entries(self.redis, source, entries)
 
     def delete_remote_entries_for_source(self, source):
-        cursor = '0'
-        while cursor != 0:
-            cursor, keys = self.redis.scan(cursor=cursor, match=f'remote_entries:{source}:*')
-            if keys:
-                # Delete the matching keys
-                self.redis.delete(*keys)    
+        delete_remote_entries(self.redis, source)
 
     def get_file_path_from_entry(self, entry:dict) -> str:
         project = entry.get("project")
@@ -314,22 +314,23 @@ class RemoteWorker:
 
     ## actions 
     def send_node_data(self):        
-        blocks = self.m_database.get_node_data_blocks()
         stats = self.m_database.get_run_stats()
-        blocks_count = len(blocks)
-
-        server_data = {
-            "source": self.m_config["source"],
-            "room": self.m_config["source"],
-            "total": blocks_count,
-            "stats": stats
-        }
 
         if self.m_remote_connection.connected():
+            # blocks are read as they are sent, not all up front.
+            blocks = self.m_database.get_node_data_blocks()
+            blocks_count = next(blocks)
+
+            server_data = {
+                "source": self.m_config["source"],
+                "room": self.m_config["source"],
+                "total": blocks_count,
+                "stats": stats
+            }
+
             try:
                 self.m_remote_connection.remote_emit("remote_node_data", server_data)
 
-                blocks_count = len(blocks)
                 for i, block in enumerate(blocks):
                     msg = {
                         "source": self.m_config["source"],
@@ -346,6 +347,8 @@ class RemoteWorker:
 
             except socketio.exceptions.BadNamespaceError as e:
                 debug_print("Bad namespace error")
+            finally:
+                blocks.close()
 
 
 
@@ -461,6 +464,7 @@ class RemoteConnection:
         }
 
         names = []
+        remote_entries = {}
 
         for run_name, run_entries in data.get("runs", {}).items():
             msg["runs"][run_name] = {}
@@ -476,7 +480,8 @@ class RemoteConnection:
                     filepath = self.m_parent.get_file_path_from_entry(item)
                     item["localpath"] = filepath
 
-                    self.m_parent.create_remote_entry(self.m_remote_source, local_id, item )
+                    # stored as it is now, before the ids are swapped below.
+                    remote_entries[local_id] = dict(item)
                     date = item["datetime"].split(" ")[0]
 
                     
@@ -508,7 +513,8 @@ class RemoteConnection:
                     item["offset"] = offset 
 
                     msg["runs"][run_name][rel_path].append(item)
-                        
+
+        self.m_parent.create_remote_entries(self.m_remote_source, remote_entries)
 
 
         self.m_parent.m_sio.emit("remote_ymd_data", data, to=room, debug=False)
@@ -2,6 +2,7 @@ import humanfriendly as hf
 import json
 import math
 import os
+import psycopg2
 import queue
 import redis
 import requests
@@ -11,11 +12,11 @@ import uuid
 import yaml
 
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timedelta
+from datetime import datetime
 from threading import Event, Thread
 
 from server.debug_print import debug_print
-from server.utils import SocketIORedirect, build_multipart_data, dashboard_room, get_device_name, get_source_by_mac_address, get_upload_id, get_datatype, pbar_thread, redis_pbar_thread
+from server.utils import SocketIORedirect, build_multipart_data, dashboard_room, delete_remote_entries, delete_remote_entries_for_date, delete_remote_entry, device_manifest_hash, fetch_manifest_digests, fetch_remote_entries_for_date, fetch_remote_stats, follow_remote_entries_expiry, get_device_name, get_source_by_mac_address, get_upload_id, get_datatype, pbar_thread, redis_pbar_thread, store_remote_entries
 from server.sqlDatabase import Database
 
 
@@ -38,11 +39,13 @@ class ServerWorker:
                 - "get_server_data_stub": Send summary data about the server.
                 - "get_server_data_ymd": Send year-month-day specific data from the server.
                 - "get_node_data_stub": Send summary data about the node.
-                - "server_scan": Perform a scan on the server.
+                - "server_scan": Perform a scan on the server. Only changed directories are read unless "full" is set.
 
             - **Device Processing**:
                 - "device_revise_stats": Revise device statistics.
                 - "device_add_entry": Add an entry to the device.
+                - "device_add_entries": Add a block of entries to the device.
+                - "device_manifest": Compare a device's manifest digests with the stored manifest.
                 - "get_device_data_stub": Send summary data for the device.
                 - "get_device_data_ymd": Send year-month-day specific data for the device.
                 - "device_request_files": Request files from the device.
@@ -71,7 +74,7 @@ class ServerWorker:
 
             - **Data Entry Management**:
                 - "add_entry": Add a new data entry.
-                - "estimate_runs": Estimate run details for data.
+                - "estimate_runs": Estimate run details for data. Only groups with new or removed entries, unless "full" is set.
                 - "update_entry_robot": Update robot name for an entry.
                 - "update_entry_site": Update site name for an entry.
 
@@ -86,6 +89,7 @@ class ServerWorker:
             - **Search Functionality**:
                 - "request_search_filters": Request search filters.
                 - "search": Perform a search based on provided filters.
+                - "search_overlap": Find the entries recorded between a start and end time.
 
             - **Other Utilities**:
                 - "request_localpath": Request the local path of a specified file.
@@ -99,6 +103,8 @@ class ServerWorker:
     - SERVERNAME. Defaults: "Server"
     - VOLUME_MAP. Default: "config/volumeMap.yaml"
     - VOLUME_ROOT: defaults = "/"
+    - DB_POOL_MIN, DB_POOL_MAX. Defaults: 1, 10. Size of the database connection pool shared by the worker threads.
+    - SEARCH_TIMEOUT_MS. Default: 30000. Longest a search query may run, 0 for no limit.
 
     """
     def __init__(self, worker_id) -> None:
@@ -235,18 +241,27 @@ class ServerWorker:
     def create_remote_entry(self, source:str, upload_id:str, entry:dict):
         """handle the remote entries redis data.
         
-        all remote entries are in the form of "remote_entries:{source}:{upload_id}"
+        all remote entries of a source are in the hash "remote_entries:{source}", keyed by upload_id,
+        and indexed by date and by project and date. See `store_remote_entries`.
             
         Args:
             source (str): Source name
             upload_id (str): Upload id
             entry (dict): Remote Entry
         """
-        entry_json = json.dumps(entry)
-        self.redis.set(f'remote_entries:{source}:{upload_id}', entry_json)
+        store_remote_entries(self.redis, source, {upload_id: entry})
+
+    def create_remote_entries(self, source:str, entries:dict):
+        """Store many remote entries of a source in pipelined batches.
+
+        Args:
+            source (str): Source name
+            entries (dict): Remote Entries by upload id
+        """
+        store_remote_entries(self.redis, source, entries)
 
     def fetch_remote_entry(self, source, upload_id):
-        entry_json = self.redis.get(f'remote_entries:{source}:{upload_id}')
+        entry_json = self.redis.hget(f'remote_entries:{source}', upload_id)
         if entry_json:
             return json.loads(entry_json)
         return None
@@ -255,31 +270,23 @@ class ServerWorker:
         if not "start_datetime" in updated_entry:
             debug_print(f"Skipping {updated_entry}")
 
-        entry_json = json.dumps(updated_entry)
-        self.redis.set(f'remote_entries:{source}:{upload_id}', entry_json)
+        # stored again, so the stats counters follow the change.
+        store_remote_entries(self.redis, source, {upload_id: updated_entry})
 
     def delete_remote_entry(self, source, upload_id):
         # Delete the entry from Redis
-        self.redis.delete(f'remote_entries:{source}:{upload_id}')
+        delete_remote_entry(self.redis, source, upload_id)
 
     def get_all_entries_for_source(self, source):
-        # Fetch all entries for a specific source
-        keys = self.redis.keys(f'remote_entries:{source}:*')
+        # Fetch all entries for a specific source. 
+        # HSCAN in batches, so a large source does not hold up redis for everyone else. 
         entries = {}
-        for key in keys:
-            upload_id = key.decode('utf-8').split(':')[-1]
-            entry_json = self.redis.get(key)
-            if entry_json:
-                entries[upload_id] = json.loads(entry_json)
+        for upload_id, entry_json in self.redis.hscan_iter(f'remote_entries:{source}', count=1000):
+            entries[upload_id.decode('utf-8')] = json.loads(entry_json)
         return entries
     
     def delete_remote_entries_for_source(self, source):
-        cursor = '0'
-        while cursor != 0:
-            cursor, keys = self.redis.scan(cursor=cursor, match=f'remote_entries:{source}:*')
-            if keys:
-                # Delete the matching keys
-                self.redis.delete(*keys)    
+        delete_remote_entries(self.redis, source)
 
     def set_node_data_stats(self, source, stats):
         debug_print("enter")
@@ -327,6 +334,8 @@ class ServerWorker:
                 self.update_volume_map()
             elif action == "update_blackout_list":
                 self.update_blackout_list()
+            elif action == "cancel_search":
+                self._cancel_search(data)
             else:                
                 debug_print(f"Unhandled action {action}")
         else:
@@ -362,11 +371,13 @@ class ServerWorker:
                 - "get_server_data_stub": Send summary data about the server.
                 - "get_server_data_ymd": Send year-month-day specific data from the server.
                 - "get_node_data_stub": Send summary data about the node.
-                - "server_scan": Perform a scan on the server.
+                - "server_scan": Perform a scan on the server. Only changed directories are read unless "full" is set.
 
             - **Device Processing**:
                 - "device_revise_stats": Revise device statistics.
                 - "device_add_entry": Add an entry to the device.
+                - "device_add_entries": Add a block of entries to the device.
+                - "device_manifest": Compare a device's manifest digests with the stored manifest.
                 - "get_device_data_stub": Send summary data for the device.
                 - "get_device_data_ymd": Send year-month-day specific data for the device.
                 - "device_request_files": Request files from the device.
@@ -400,7 +411,7 @@ class ServerWorker:
 
             - **Data Entry Management**:
                 - "add_entry": Add a new data entry.
-                - "estimate_runs": Estimate run details for data.
+                - "estimate_runs": Estimate run details for data. Only groups with new or removed entries, unless "full" is set.
                 - "update_entry_robot": Update robot name for an entry.
                 - "update_entry_site": Update site name for an entry.
 
@@ -415,6 +426,7 @@ class ServerWorker:
             - **Search Functionality**:
                 - "request_search_filters": Request search filters.
                 - "search": Perform a search based on provided filters.
+                - "search_overlap": Find the entries recorded between a start and end time.
 
             - **Other Utilities**:
                 - "request_localpath": Request the local path of a specified file.
@@ -435,6 +447,10 @@ class ServerWorker:
             self._device_revise_stats(data)
         elif action == "device_add_entry":
             self._device_add_entry(data)
+        elif action == "device_add_entries":
+            self._device_add_entries(data)
+        elif action == "device_manifest":
+            self._device_manifest(data)
         elif action == "get_device_data_stub":
             self._send_device_data_stub(data)
         elif action == "get_device_data_ymd":
@@ -516,6 +532,8 @@ class ServerWorker:
             self._request_search_filters(data)
         elif action == "search":
             self._search(data)
+        elif action == "search_overlap":
+            self._search_overlap(data)
 
         # other
         elif action == "request_localpath":
@@ -612,13 +630,16 @@ class ServerWorker:
         # debug_print(f"data_for: {data_for}")
 
         project, ymd = names
-        datasets = self.m_database.get_send_data_ymd(project, ymd)
         stats = self.m_database.get_run_stats(project, ymd)
         room = dashboard_room(data)
-        total = len(datasets)
+        nodes = self.get_sources("node")
+
+        # each block is sent as soon as it is read.
+        datasets = self.m_database.get_send_data_ymd(project, ymd)
+        total = next(datasets)
 
-        for node in self.get_sources("node"):
-            for dataset in datasets:
+        for i, dataset in enumerate(datasets):
+            for node in nodes:
                 for run in dataset:
                     for entries in dataset[run].values():
                         for entry in entries:
@@ -628,13 +649,11 @@ class ServerWorker:
                             except TypeError as e:
                                 debug_print(entry)
                                 raise e
-                    
 
-        for i, data in enumerate(datasets):
             server_data = {
                 "total": total,
                 "index": i,
-                "runs": data,
+                "runs": dataset,
                 "stats": stats,
                 "source": self.m_config["source"],
                 "project": project,
@@ -648,94 +667,151 @@ class ServerWorker:
 
     # device data 
     def _device_revise_stats(self, data):
-        sources = data.get("source")
+        sources = data.get("sources", data.get("source"))
         stats = {}
 
         if sources is None:
             return 
         
         for source in sources:
-
-            stats[source] = {
-                "total_size": 0,
-                "count": 0,
-                "start_datetime": None,
-                "end_datetime": None,
-                "datatype": {},
-                "on_server_size": 0,
-                "on_server_count": 0,
-            }
-
-            entries = self.get_all_entries_for_source(source)
-            for entry in entries.values():
-                self._update_stat_for_entry(entry, stats[source])
+            # read from the counters kept as entries are stored, see store_remote_entries.
+            counters = fetch_remote_stats(self.redis, source, dates=[])
+            stats[source] = self._format_stat(counters.get("total"))
 
         self.m_sio.emit("device_revise_stats", stats, to="all_dashboards")
 
     def _device_add_entry(self, data):
-        entry = data.get("entry")
-        source = data.get("source")
+        self._device_add_entries({"source": data.get("source"), "entries": [data.get("entry")]})
 
-        dirroot = entry.get("dirroot")
-        file = entry.get("filename")
-        size = entry.get("size")
-        start_datetime = entry.get("start_time")
-        end_datetime = entry.get("end_time")
-        md5 = entry.get("md5")
-        robot_name = entry.get("robot_name")
-        if robot_name and len(robot_name) > 0:
-            if not self.m_database.has_robot_name(robot_name):
-                # debug_print("=================== adding " + robot_name)
-                self.m_database.add_robot_name(robot_name, "")
-                self._request_robot_names({"room":"all_dashboards"})
-                
-        site = entry.get("site")
-        topics = entry.get("topics", {})
+    def _device_add_entries(self, data):
+        """Add a block of entries sent by a device.
+
+        Robot names are checked once per block, each target directory on the 
+        server is listed once, and the entries are stored in one pipeline.
+
+        Args:
+            data (dict): 
+                - "source" (str): the device
+                - "entries" (List[dict]): entries as sent by the device
+        """
+        source = data.get("source")
         project = self.device_get_project(source)
 
-        upload_id = get_upload_id(source, project, file)
+        robot_names = {entry.get("robot_name") for entry in data.get("entries", [])}
+        added_robot = False
+        for robot_name in robot_names:
+            if robot_name and len(robot_name) > 0:
+                if not self.m_database.has_robot_name(robot_name):
+                    self.m_database.add_robot_name(robot_name, "")
+                    added_robot = True
+        if added_robot:
+            self._request_robot_names({"room":"all_dashboards"})
+
+        # names in each target directory, listed on first use. 
+        listings = {}
+        entries = {}
+        for entry in data.get("entries", []):
+            dirroot = entry.get("dirroot")
+            file = entry.get("filename")
+            start_datetime = entry.get("start_time")
+            manifest_hash = device_manifest_hash(entry)
 
-        entry = {
-            "project": project,
-            "robot_name": robot_name,
-            "run_name": None,
-            "datatype": get_datatype(file),
-            "relpath": os.path.dirname(file),
-            "basename": os.path.basename(file),
-            "fullpath": file,
-            "size": size,
-            "site": site,
-            "date": start_datetime.split(" ")[0],
-            "datetime": start_datetime,
-            "start_datetime": start_datetime,
-            "end_datetime": end_datetime,
-            "upload_id": upload_id,
-            "dirroot": dirroot,
-            "remote_dirroot": dirroot,
-            "status": None,
-            "temp_size": 0,
-            "on_device": True,
-            "on_server": False,
-            "md5": md5,
-            "topics": topics,
-            "temp_size": 0
-        }
+            upload_id = get_upload_id(source, project, file)
+
+            entry = {
+                "project": project,
+                "robot_name": entry.get("robot_name"),
+                "run_name": None,
+                "datatype": get_datatype(file),
+                "relpath": os.path.dirname(file),
+                "basename": os.path.basename(file),
+                "fullpath": file,
+                "size": entry.get("size"),
+                "site": entry.get("site"),
+                "date": start_datetime.split(" ")[0],
+                "datetime": start_datetime,
+                "start_datetime": start_datetime,
+                "end_datetime": entry.get("end_time"),
+                "upload_id": upload_id,
+                "dirroot": dirroot,
+                "remote_dirroot": dirroot,
+                "status": None,
+                "on_device": True,
+                "on_server": False,
+                "md5": entry.get("md5"),
+                "topics": entry.get("topics", {}),
+                "temp_size": 0
+            }
+
+            filepath = self._get_file_path_from_entry(entry)
+            filedir = os.path.dirname(filepath)
+            if filedir not in listings:
+                try:
+                    listings[filedir] = set(os.listdir(filedir))
+                except OSError:
+                    listings[filedir] = set()
+            names = listings[filedir]
+
+            status = "On Device"
+            if entry["basename"] in names:
+                status = "On Device and Server"
+                entry["on_server"] = True
+            if entry["basename"] + ".tmp" in names:
+                status = "Interrupted transfer"
+                entry["temp_size"] = os.path.getsize(
+                    filepath + ".tmp"
+                )
+            entry["status"] = status
+            entry["localpath"] = filepath
+            entry["manifest_hash"] = manifest_hash
+
+            entries[upload_id] = entry
+
+        # debug_print(f"added {len(entries)} to {source}")
+        self.create_remote_entries(source, entries)
+
+    def _device_manifest(self, data):
+        """Compare the manifest digests of a reconnecting device with the stored manifest.
+
+        Entries of the dates that changed, or that are no longer on the device, are 
+        removed. The device is sent "device_manifest_diff" with the dates it has to 
+        send again as "device_data_block". See docs/Devices.md.
+
+        Args:
+            data (dict): 
+                - "source" (str): the device
+                - "project" (str): project of the device
+                - "digests" (dict): digest of each date on the device
+        """
+        source = data.get("source")
+        project = str(data.get("project"))
+        digests = data.get("digests", {})
+
+        manifest_key = f"device_manifest:{source}"
+        stored_project = self.redis.hget(manifest_key, "project")
+        if stored_project is None or stored_project.decode("utf-8") != project:
+            # upload ids depend on the project, nothing stored can be kept.
+            self.delete_remote_entries_for_source(source)
+            stored = {}
+        else:
+            stored = fetch_manifest_digests(self.redis, source)
+
+        changed = sorted(date for date, digest in digests.items() if stored.get(date) != digest)
+        removed = sorted(date for date in stored if date not in digests)
+        for date in changed + removed:
+            # changed dates are sent again in full.
+            delete_remote_entries_for_date(self.redis, source, date)
+
+        self.redis.hset(manifest_key, "project", project)
+        version = self.redis.hincrby(manifest_key, "version", 1)
+        # the device may have disconnected while this was queued.
+        follow_remote_entries_expiry(self.redis, source, manifest_key)
+        debug_print(f"{source} manifest {version}: {len(changed)} changed, {len(removed)} removed, {len(digests) - len(changed)} kept")
 
-        filepath = self._get_file_path_from_entry(entry)
-        status = "On Device"
-        if os.path.exists(filepath):
-            status = "On Device and Server"
-            entry["on_server"] = True
-        if os.path.exists(filepath + ".tmp"):
-            status = "Interrupted transfer"
-            entry["temp_size"] = os.path.getsize(
-                filepath + ".tmp"
-            )
-        entry["status"] = status
-        entry["localpath"] = filepath
-
-        # debug_print(f"added {source} {upload_id}")
-        self.create_remote_entry(source, upload_id, entry)
+        self.m_sio.emit("device_manifest_diff", {"source": source, "version": version, "dates": changed}, to=source)
+        if len(changed) == 0:
+            # no blocks will arrive to trigger it.
+            self._send_device_data_stub()
 
     def _get_device_fs_info(self, source):
         fs_info_json = self.redis.get(f'fs_info:{source}')
@@ -758,48 +834,12 @@ class ServerWorker:
 
     def _get_device_data_stats(self, source):
         device_data = {}        
-        entries = self.get_all_entries_for_source(source)
+        counters = fetch_remote_stats(self.redis, source)
 
-        debug_print(f"entries: {len(entries)}")
+        debug_print(f"stats: {len(counters)}")
 
-        for remote_entry in entries.values():
-            uid = remote_entry["upload_id"]
-            entry = {}
-            for key in ["size", "site", "robot_name", "upload_id", "on_device", "on_server", "basename", "datetime", "topics" ]:
-                entry[key] = remote_entry[key]
-
-            entry["size"] = hf.format_size(entry["size"])
-            date = remote_entry["datetime"].split(" ")[0]
-
-            device_data["stats"] = device_data.get(
-                "stats",
-                {
-                    "total": {
-                        "total_size": 0,
-                        "count": 0,
-                        "start_datetime": None,
-                        "end_datetime": None,
-                        "datatype": {},
-                        "on_server_size": 0,
-                        "on_server_count": 0,
-                    }
-                },
-            )
-            device_data["stats"][date] = device_data["stats"].get(
-                date,
-                {
-                    "total_size": 0,
-                    "count": 0,
-                    "start_datetime": None,
-                    "end_datetime": None,
-                    "datatype": {},
-                    "on_server_size": 0,
-                    "on_server_count": 0,
-                },
-            )
-
-            self._update_stat(source, uid, device_data["stats"][date])
-            self._update_stat(source, uid, device_data["stats"]["total"])
+        if len(counters) > 0:
+            device_data["stats"] = {name: self._format_stat(counter) for name, counter in counters.items()}
 
         return device_data
 
@@ -871,20 +911,15 @@ class ServerWorker:
         count = 0 
         total = 0
         
-        entries = self.get_all_entries_for_source(source)
-        if len(entries) == 0:
+        if not self.redis.exists(f'remote_entries:{source}'):
             debug_print(f"Source: {source} missing")
             return 
 
+        # only this day's entries, from the date index.
+        entries = fetch_remote_entries_for_date(self.redis, source, ymd)
         # debug_print(f"ymd: {ymd}, len(entries): {len(entries)}")
 
         for remote_entry in entries.values():
-            if ymd != remote_entry["date"]:
-                continue 
-            # date = remote_entry["datetime"].split(" ")[0]
-            # if date != ymd:
-            #     continue
-
             entry = {}
             for key in ["size", "site", "robot_name", "upload_id", "on_device", "on_server", "basename", "datetime", "topics" ]:
                 entry[key] = remote_entry[key]
@@ -905,13 +940,6 @@ class ServerWorker:
         # debug_print(f"ymd: {ymd}, total: {total}")
         return rtnarr 
 
-    def _update_stat(self, source, uid, stat):
-        entry = self.fetch_remote_entry(source, uid)
-        if entry:
-            self._update_stat_for_entry(entry, stat)
-        else: 
-            debug_print(f"Did not find {source} {uid}")
-
     def _get_device_run_stats(self, source, ymd):
         device_data = {}
         
@@ -925,47 +953,13 @@ class ServerWorker:
             if fs_info:
                 device_data[source]["fs_info"] = fs_info
 
-            entries = self.get_all_entries_for_source(source)
-            for remote_entry in entries.values():
-                uid = remote_entry["upload_id"]
-                date = remote_entry["datetime"].split(" ")[0]
-                if date != ymd:
-                    continue
-                entry = {}
-                for key in ["size", "site", "robot_name", "upload_id", "on_device", "on_server", "basename", "datetime", "topics" ]:
-                    entry[key] = remote_entry[key]
-
-                entry["size"] = hf.format_size(entry["size"])
-
-                device_data[source]["stats"] = device_data[source].get(
-                    "stats",
-                    {
-                        "total": {
-                            "total_size": 0,
-                            "count": 0,
-                            "start_datetime": None,
-                            "end_datetime": None,
-                            "datatype": {},
-                            "on_server_size": 0,
-                            "on_server_count": 0,
-                        }
-                    },
-                )
-                device_data[source]["stats"][date] = device_data[source]["stats"].get(
-                    date,
-                    {
-                        "total_size": 0,
-                        "count": 0,
-                        "start_datetime": None,
-                        "end_datetime": None,
-                        "datatype": {},
-                        "on_server_size": 0,
-                        "on_server_count": 0,
-                    },
-                )
-
-                self._update_stat(source, uid, device_data[source]["stats"][date])
-                self._update_stat(source, uid, device_data[source]["stats"]["total"])
+            counters = fetch_remote_stats(self.redis, source, [ymd])
+            if ymd in counters:
+                # only this day is counted, so the total is the same.
+                device_data[source]["stats"] = {
+                    "total": self._format_stat(counters[ymd]),
+                    ymd: self._format_stat(counters[ymd]),
+                }
 
         return device_data
 
@@ -1007,11 +1001,12 @@ class ServerWorker:
     # add / remove database entries
     def _add_entry(self, data):
         entry = data.get("entry")
-        self.m_database.add_entry(entry)
+        self.m_database.add_entries([entry])
         # self.m_database._set_runs()
 
     def _estimate_runs(self, data):
-        self.m_database._set_runs()
+        full = data.get("full", False) if data else False
+        self.m_database._set_runs(incremental=not full)
         self.m_sio.emit("has_new_data", {"value": True}, to="all_dashboards")
 
     # remote server:
@@ -1257,61 +1252,49 @@ class ServerWorker:
                 self.m_blackout = yaml.safe_load(f)
         self.m_database.update_blackout_list(self.m_blackout)
 
-    def _update_stat_for_entry(self, entry, stat):
-        filename = self._get_file_path_from_entry(entry)
-        on_server = os.path.exists(filename)
+    def _format_stat(self, counters: dict = None) -> dict:
+        """Format stats counters for the dashboard.
 
-        size = entry["size"]
-        start_time = entry["start_datetime"]
-        end_time = entry["end_datetime"]
-        datatype = entry["datatype"]
+        Args:
+            counters (dict, optional): One item returned by `fetch_remote_stats`. Defaults to None, no entries.
 
+        Returns:
+            dict: stat with human friendly sizes and the duration
+        """
+        stat = {
+            "total_size": 0,
+            "count": 0,
+            "start_datetime": None,
+            "end_datetime": None,
+            "datatype": {},
+            "on_server_size": 0,
+            "on_server_count": 0,
+        }
+        if not counters:
+            return stat
 
-        stat["total_size"] += size
+        for key in ["total_size", "count", "on_server_size", "on_server_count", "start_datetime", "end_datetime"]:
+            stat[key] = counters.get(key, stat[key])
         stat["htotal_size"] = hf.format_size(stat["total_size"])
-        stat["count"] += 1
-
-        if on_server:
-            stat["on_server_size"] += size
-            stat["on_server_count"] += 1
-
         stat["on_server_hsize"] = hf.format_size(stat["on_server_size"])
 
-        if stat["start_datetime"]:
-            stat["start_datetime"] = min(start_time, stat["start_datetime"])
-        else:
-            stat["start_datetime"] = start_time
-
-        if stat["end_datetime"]:
-            stat["end_datetime"] = max(end_time, stat["end_datetime"])
-        else:
-            stat["end_datetime"] = end_time
-
-        duration = datetime.strptime(
-            stat["end_datetime"], "%Y-%m-%d %H:%M:%S"
-        ) - datetime.strptime(stat["start_datetime"], "%Y-%m-%d %H:%M:%S")
-
-
-        assert isinstance(duration, timedelta)
-        stat["duration"] = duration.seconds
-        stat["hduration"] = hf.format_timespan(duration.seconds)
-
-        stat["datatype"][datatype] = stat["datatype"].get(
-            datatype,
-            {"total_size": 0, "count": 0, "on_server_size": 0, "on_server_count": 0},
-        )
-        stat["datatype"][datatype]["total_size"] += size
-        stat["datatype"][datatype]["htotal_size"] = hf.format_size(
-            stat["datatype"][datatype]["total_size"]
-        )
-        stat["datatype"][datatype]["count"] += 1
-
-        if on_server:
-            stat["datatype"][datatype]["on_server_size"] += size
-            stat["datatype"][datatype]["on_server_count"] += 1
-        stat["datatype"][datatype]["on_server_hsize"] = hf.format_size(
-            stat["datatype"][datatype]["on_server_size"]
-        )
+        if stat["start_datetime"] and stat["end_datetime"]:
+            duration = datetime.strptime(
+                stat["end_datetime"], "%Y-%m-%d %H:%M:%S"
+            ) - datetime.strptime(stat["start_datetime"], "%Y-%m-%d %H:%M:%S")
+            stat["duration"] = duration.seconds
+            stat["hduration"] = hf.format_timespan(duration.seconds)
+
+        for datatype, counts in counters.get("datatype", {}).items():
+            stat["datatype"][datatype] = {
+                "total_size": counts.get("total_size", 0),
+                "count": counts.get("count", 0),
+                "on_server_size": counts.get("on_server_size", 0),
+                "on_server_count": counts.get("on_server_count", 0),
+            }
+            stat["datatype"][datatype]["htotal_size"] = hf.format_size(stat["datatype"][datatype]["total_size"])
+            stat["datatype"][datatype]["on_server_hsize"] = hf.format_size(stat["datatype"][datatype]["on_server_size"])
+        return stat
 
     def _get_file_path_from_entry(self, entry:dict) -> str:
         project = entry.get("project")
@@ -1446,8 +1429,8 @@ class ServerWorker:
             # self.m_node_entries[source]["entries"][project][ymd][run_name][relpath].append(entry)
 
             # debug_print(f"added {upload_id}")
-            self.create_remote_entry(source, upload_id, entry)
 
+        self.create_remote_entries(source, rtn)
 
         # debug_print(f"emit rtn to {source}")
         msg = {"entries": rtn}
@@ -1511,14 +1494,9 @@ class ServerWorker:
 
         runs = {}
 
-        entries = self.get_all_entries_for_source(source)
+        entries = fetch_remote_entries_for_date(self.redis, source, ymd, project)
         if entries:
             for entry in entries.values():
-                if entry["project"] != project:
-                    continue
-                if entry["date"] != ymd:
-                    continue
-
                 run_name = entry["run_name"]
                 rel_path = entry["relpath"]
                 # debug_print(f"remote_id: {entry['remote_id']}")
@@ -1744,38 +1722,125 @@ class ServerWorker:
         room = dashboard_room(data)
         self.m_sio.emit("search_filters", search_filters, to=room)
 
+    def _search_is_stale(self, room: str, seq: int) -> bool:
+        """A search is stale once a newer one was sent for the same room.
+
+        Args:
+            room (str): Room the search was sent from
+            seq (int): Sequence number given to the search by the frontend, None for no sequence
+
+        Returns:
+            bool: True if a newer search is waiting or running.
+        """
+        if seq is None:
+            return False
+        latest = self.redis.get(f"search_seq:{room}")
+        return latest is not None and int(latest) > seq
+
+    def _cancel_search(self, data):
+        # sent to every worker, only the one running the search has anything to cancel.
+        if self.m_database is None:
+            return
+        if self.m_database.cancel_search(data.get("room"), int(data.get("seq"))):
+            debug_print(f"Cancelled search {data.get('seq')} for {data.get('room')}")
+
     def _search(self, data):
         room = data.get("room", None)
+        seq = data.get("seq")
+        if self._search_is_stale(room, seq):
+            # a newer search is queued behind this one.
+            debug_print(f"Dropped stale search {seq} for {room}")
+            return
         filter = data.get("filter", {})
+        if not isinstance(filter, dict):
+            filter = {}
         sort_key = data.get("sort-key", "datetime")
         reverse = data.get("sort-direction", "forward") == "reverse"
-        page_size = data.get("results-per-page", 25)
-        offset = data.get("start_index", 0)
+        page_size = int(data.get("results-per-page", 25))
+        cursor = data.get("cursor")
+        direction = data.get("direction", "first")
+        # the page the client is moving to, only for display.
+        page = int(data.get("page", 0))
+        facets = bool(data.get("facets", False))
 
         if sort_key == "filename":
             sort_key = "basename"
 
         # do the search
-        results, total = self.m_database.search(filter, sort_key, offset, page_size, reverse)
+        try:
+            results, total, prev_cursor, next_cursor, facet_counts = self.m_database.search(
+                filter, sort_key, page_size, reverse, cursor, direction, facets, search=(room, seq))
+        except psycopg2.extensions.QueryCanceledError:
+            if self._search_is_stale(room, seq):
+                debug_print(f"Search {seq} for {room} was superseded")
+                return
+            debug_print(f"Search {seq} for {room} timed out")
+            self.m_sio.emit("search_results", {"error": "Search timed out, try narrowing the filters."}, to=room)
+            return
+
+        if self._search_is_stale(room, seq):
+            debug_print(f"Dropped results of stale search {seq} for {room}")
+            return
 
         # format the search
         total_pages = int(math.ceil(float(total)/float(page_size)))
-        current_page = int(offset) // int(page_size)
+        if direction == "last":
+            current_page = max(0, total_pages - 1)
+        elif direction == "first" or (cursor is None):
+            current_page = 0
+        else:
+            current_page = min(max(0, page), max(0, total_pages - 1))
+
         msg = {
             "total_pages": total_pages,
             "current_page": current_page,
-            "current_index": offset,
+            "current_index": current_page * page_size,
+            "prev_cursor": prev_cursor,
+            "next_cursor": next_cursor,
             "results": results
         }
+        if facets:
+            msg["facets"] = facet_counts
         self.m_sio.emit("search_results", msg, to=room)
 
 
 
+    def _search_overlap(self, data):
+        room = data.get("room", None)
+        start = data.get("start")
+        end = data.get("end")
+        filter = data.get("filter", {})
+        if not isinstance(filter, dict):
+            filter = {}
+        limit = int(data.get("limit", 1000))
+
+        try:
+            results, truncated = self.m_database.find_overlapping(start, end, filter, limit)
+        except ValueError as e:
+            debug_print(f"Bad overlap search {start} {end}: {e}")
+            self.m_sio.emit("search_overlap_results", {"start": start, "end": end, "error": f"Invalid time: {e}"}, to=room)
+            return
+
+        robots = {}
+        for entry in results:
+            robot_name = entry["robot_name"] or "None"
+            robots[robot_name] = robots.get(robot_name, [])
+            robots[robot_name].append(entry)
+
+        msg = {
+            "start": start,
+            "end": end,
+            "robots": robots,
+            "truncated": truncated
+        }
+        self.m_sio.emit("search_overlap_results", msg, to=room)
+
     ##### debug
 
     def _scan_server(self, data):
         event = "server_regen_msg"
-        debug_print("Scanning server")
-        self.m_database.regenerate(event=event, room="all_dashboards")
+        full = data.get("full", False) if data else False
+        debug_print(f"Scanning server, full: {full}")
+        self.m_database.regenerate(event=event, room="all_dashboards", full=full)
 
         self._send_server_data({})
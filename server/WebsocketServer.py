@@ -1,4 +1,6 @@
+import csv
 import hashlib
+import io
 import json
 import os
 import redis
@@ -9,7 +11,7 @@ import urllib
 import uuid
 import yaml
 
-from flask import flash, jsonify, make_response, redirect, render_template, request, send_from_directory, session, url_for
+from flask import Response, flash, jsonify, make_response, redirect, render_template, request, send_from_directory, session, stream_with_context, url_for
 from flask_socketio import SocketIO, disconnect, join_room
 from threading import Event, Thread
 from zeroconf import NonUniqueNameException, ServiceInfo, Zeroconf
@@ -17,7 +19,8 @@ from zeroconf import NonUniqueNameException, ServiceInfo, Zeroconf
 from server.__version__ import __version__
 from server.debug_print import debug_print
 from server.ServerWorker import get_source_by_mac_address
-from server.utils import dashboard_room, get_ip_addresses
+from server.sqlDatabase import Database
+from server.utils import dashboard_room, delete_remote_entries, expire_remote_entries, get_ip_addresses, store_remote_entries
 
 
 
@@ -41,6 +44,10 @@ class WebsocketServer:
 
         self.m_zeroconf = None
         self.m_device_files_buffer = {}
+        # read only, created on first use. The workers own the schema.
+        self.m_database = None
+        # DEVICE_MANIFEST_TTL_S: how long the entries of a disconnected device are kept. Default 7 days.
+        self.m_device_manifest_ttl_s = int(os.environ.get("DEVICE_MANIFEST_TTL_S", 7 * 24 * 3600))
 
         self.pubsub = self.redis.pubsub()
         self._load_config()    
@@ -129,13 +136,13 @@ class WebsocketServer:
         self.on_request_keys()
         pass 
 
-    # all remote entries are in the form of "remote_entries:{source}:{upload_id}"
+    # all remote entries of a source are in the hash "remote_entries:{source}", keyed by upload_id
+    # and indexed by date, see store_remote_entries
     def create_remote_entry(self, source, upload_id, entry):
-        entry_json = json.dumps(entry)
-        self.redis.set(f'remote_entries:{source}:{upload_id}', entry_json)
+        store_remote_entries(self.redis, source, {upload_id: entry})
 
     def fetch_remote_entry(self, source, upload_id):
-        entry_json = self.redis.get(f'remote_entries:{source}:{upload_id}')
+        entry_json = self.redis.hget(f'remote_entries:{source}', upload_id)
         if entry_json:
             return json.loads(entry_json)
         return None
@@ -144,16 +151,20 @@ class WebsocketServer:
         if not "start_datetime" in updated_entry:
             debug_print(f"Skipping {updated_entry}")
 
-        entry_json = json.dumps(updated_entry)
-        self.redis.set(f'remote_entries:{source}:{upload_id}', entry_json)
+        # stored again, so the stats counters follow the change.
+        store_remote_entries(self.redis, source, {upload_id: updated_entry})
+
+    def mark_remote_entry_on_server(self, source, upload_id):
+        # the device stats count it as on the server from now on.
+        entry = self.fetch_remote_entry(source, upload_id)
+        if entry:
+            entry["on_server"] = True
+            entry["status"] = "On Device and Server"
+            entry["temp_size"] = 0
+            self.update_remote_entry(source, upload_id, entry)
 
     def delete_remote_entries_for_source(self, source):
-        cursor = '0'
-        while cursor != 0:
-            cursor, keys = self.redis.scan(cursor=cursor, match=f'remote_entries:{source}:*')
-            if keys:
-                # Delete the matching keys
-                self.redis.delete(*keys)    
+        delete_remote_entries(self.redis, source)
 
     def set_device_fs_info(self, source, fs_info):
         fs_info_json = json.dumps(fs_info)
@@ -595,8 +606,19 @@ class WebsocketServer:
         self._submit_action("request_search_filters", data)
 
     def on_search(self, data):
+        # each search supersedes the ones before it from the same room. 
+        # the workers drop stale searches still queued, and cancel the one running.
+        room = data.get("room")
+        key = f"search_seq:{room}"
+        seq = self.redis.incr(key)
+        self.redis.expire(key, 24 * 3600)
+        data["seq"] = seq
+        self.redis.publish("broadcast", json.dumps({"action": "cancel_search", "room": room, "seq": seq}))
         self._submit_action("search", data)
 
+    def on_search_overlap(self, data):
+        self._submit_action("search_overlap", data)
+
     # device 
     ## device data
     def on_device_status(self, data):
@@ -703,6 +725,15 @@ class WebsocketServer:
 
         self.redis.delete(f"device_data_blocks:{source}")
 
+        # connected again, what is stored from now on is kept.
+        expire_remote_entries(self.redis, source)
+        if "digests" in data:
+            # the device sends only the dates whose digest changed, once the workers answer.
+            self._submit_action("device_manifest", {"source": source, "project": project, "digests": data["digests"]})
+        else:
+            # the device sends everything again.
+            self.delete_remote_entries_for_source(source)
+
     def on_estimate_runs(self, data):
         debug_print(data)
         self._submit_action("estimate_runs", data)
@@ -713,8 +744,8 @@ class WebsocketServer:
         id = data.get("id")
         block = data.get("block")
 
-        for entry in block:
-            self._submit_action("device_add_entry", {"source": source, "entry": entry})            
+        # the whole block is one work item.
+        self._submit_action("device_add_entries", {"source": source, "entries": block})
 
         self.redis.sadd(f"device_data_blocks:{source}", id)
         arrived = self.redis.smembers(f"device_data_blocks:{source}")
@@ -848,9 +879,13 @@ class WebsocketServer:
             # device related
             if remove in self.m_device_files_buffer: del self.m_device_files_buffer[remove]
             self.remove_device_fs_info(remove)
-            self.delete_remote_entries_for_source(remove)
             self.device_remove_project(remove)
-            self._clear_node_data(remove)
+            if source_type == "device":
+                # kept for the reconnect, see on_device_data. 
+                expire_remote_entries(self.redis, remove, self.m_device_manifest_ttl_s)
+            else:
+                self.delete_remote_entries_for_source(remove)
+                self._clear_node_data(remove)
 
             if source_type == "node":
                 self._send_node_data()
@@ -1197,6 +1232,7 @@ class WebsocketServer:
                 return jsonify({"message": f"File {filename} upload canceled"})
 
             os.rename(tmp_path, filepath)
+            self.mark_remote_entry_on_server(source, upload_id)
 
             data = {
                 "div_id": f"status_{upload_id}",
@@ -1269,6 +1305,80 @@ class WebsocketServer:
         return "File Not Found", 404
 
 
+    def _get_database(self) -> Database:
+        if self.m_database is None:
+            self.m_database = Database({}, [], init=False)
+        return self.m_database
+
+    def export_search(self):
+        """Stream every entry matching a search, as NDJSON or CSV.
+
+        Takes the same filter document as the "search" message, as a JSON body, 
+        or as query arguments with "filter" JSON encoded:
+            - "filter" (dict): search filters
+            - "sort-key" (str): default "datetime"
+            - "sort-direction" (str): "forward" or "reverse"
+            - "format" (str): "ndjson" (default) or "csv"
+            - "cursor" (str): resume after the entry with this cursor
+
+        Every row includes its "cursor".
+        """
+        params = dict(request.args)
+        params.update(request.get_json(silent=True) or {})
+
+        filter = params.get("filter", {})
+        if isinstance(filter, str):
+            try:
+                filter = json.loads(filter)
+            except ValueError:
+                return "Invalid filter", 400
+        sort_key = params.get("sort-key", "datetime")
+        if sort_key == "filename":
+            sort_key = "basename"
+        reverse = params.get("sort-direction", "forward") == "reverse"
+        export_format = params.get("format", "ndjson")
+        cursor = params.get("cursor")
+
+        if export_format not in ("ndjson", "csv"):
+            return "Unknown format " + export_format, 400
+
+        entries = self._get_database().export_search(filter, sort_key, reverse, cursor)
+        try:
+            # runs the query now, so a bad request fails before the response starts.
+            first = next(entries, None)
+        except ValueError as e:
+            return str(e), 400
+
+        def generate_ndjson():
+            if first is None:
+                return
+            yield json.dumps(first, default=str) + "\n"
+            for entry in entries:
+                yield json.dumps(entry, default=str) + "\n"
+
+        columns = ["upload_id", "project", "site", "robot_name", "run_name", "datatype", "datetime", 
+                   "start_datetime", "end_datetime", "size", "basename", "relpath", "fullpath", 
+                   "localpath", "md5", "cursor"]
+
+        def generate_csv():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            if first is not None:
+                writer.writerow(first)
+                for i, entry in enumerate(entries):
+                    writer.writerow(entry)
+                    if i % 1000 == 0:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+            yield buffer.getvalue()
+
+        if export_format == "csv":
+            return Response(stream_with_context(generate_csv()), mimetype="text/csv", 
+                            headers={"Content-Disposition": "attachment; filename=search.csv"})
+        return Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson")
+
     ### remote connection
     def on_server_connect(self, data):
         address = data.get("address", None)
@@ -1394,7 +1504,8 @@ class WebsocketServer:
     ### debug
 
     def on_debug_scan_server(self, data=None):
-        self._submit_action("server_scan", {})
+        full = bool(data.get("full", False)) if isinstance(data, dict) else False
+        self._submit_action("server_scan", {"full": full})
 
     def on_debug_send(self, data):
         debug_print(data)
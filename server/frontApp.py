@@ -39,6 +39,7 @@ def create_server():
     app.route("/login", methods=["POST"])(server.login)
     app.route("/file/<string:source>/<string:upload_id>", methods=["POST"])(server.handle_file)
     app.route("/download/<string:upload_id>")(server.download_file)
+    app.route("/export", methods=["GET", "POST"])(server.export_search)
     app.route("/uploadKeys", methods=["POST"])(server.upload_keys)
     app.route('/downloadKeys')(server.download_keys)
     app.route("/static/js/<path:path>")(server.serve_js)
@@ -92,6 +93,7 @@ def create_server():
     # # search
     socketio.on("request_search_filters")(server.on_request_search_filters)
     socketio.on("search")(server.on_search)
+    socketio.on("search_overlap")(server.on_search_overlap)
 
     # remote node
     socketio.on("request_node_ymd_data")(server.on_request_node_ymd_data)
@@ -1,6 +1,9 @@
 var search_current_page = 0;
 var search_total_pages = 0;
 var search_current_index = 0;
+// opaque positions of the pages around the current one, from the server
+var search_prev_cursor = null;
+var search_next_cursor = null;
 // this should be a selectable option
 var results_per_page = 15;
 
@@ -8,9 +11,7 @@ var search_sort_name = "datetime";
 var search_sort_direction = "forward"
 
 
-function searchFirst() {
-    const start_idx = 0;
-
+function sendSearch(direction, cursor, page) {
     filter = readFilter();
     console.log(filter);
 
@@ -21,75 +22,40 @@ function searchFirst() {
         "sort-key": search_sort_name,
         "sort-direction": search_sort_direction,
         "results-per-page": results_per_page,
-        "start_index": start_idx
+        "direction": direction,
+        "cursor": cursor,
+        "page": page,
+        "facets": true
     }
     socket.emit("search", msg)
+}
 
+function searchFirst() {
+    sendSearch("first", null, 0);
 }
 
 function searchPrevPage() {
     console.log("Prev")
-
-    const start_idx = parseInt(search_current_index) - parseInt(results_per_page);
-
-    filter = readFilter();
-    console.log(filter);
-
-    room = "dashboard-" + window.session_token;
-    msg = {
-        "room": room,
-        "filter": filter,
-        "sort-key": search_sort_name,
-        "sort-direction": search_sort_direction,
-        "results-per-page": results_per_page,
-        "start_index": start_idx
+    if (!search_prev_cursor) {
+        return;
     }
-    socket.emit("search", msg)
-
+    sendSearch("prev", search_prev_cursor, parseInt(search_current_page) - 1);
 }
 
 
 function searchNextPage() {
     console.log("next")
-
-    const start_idx = parseInt(search_current_index) + parseInt(results_per_page);
-
-    filter = readFilter();
-    console.log(filter);
-
-    room = "dashboard-" + window.session_token;
-    msg = {
-        "room": room,
-        "filter": filter,
-        "sort-key": search_sort_name,
-        "sort-direction": search_sort_direction,
-        "results-per-page": results_per_page,
-        "start_index": start_idx
+    if (!search_next_cursor) {
+        return;
     }
-    socket.emit("search", msg)
+    sendSearch("next", search_next_cursor, parseInt(search_current_page) + 1);
 }
 
 function searchLast() {
-    const start_idx = (parseInt(search_total_pages)-1)*parseInt(results_per_page)
-    if(start_idx < 0) {
+    if (parseInt(search_total_pages) < 1) {
         return;
     }
-
-
-    filter = readFilter();
-    console.log(filter);
-
-    room = "dashboard-" + window.session_token;
-    msg = {
-        "room": room,
-        "filter": filter,
-        "sort-key": search_sort_name,
-        "sort-direction": search_sort_direction,
-        "results-per-page": results_per_page,
-        "start_index": start_idx
-    }
-    socket.emit("search", msg)
-
+    sendSearch("last", null, parseInt(search_total_pages) - 1);
 }
 
 function updateSearchFilters(msg) {
@@ -144,14 +110,41 @@ function updateSearchFilters(msg) {
                 label.for = "filter-" + name + "-" + filter_item;
                 label.innerHTML = filter_item
                 cord_body.appendChild(label);
+
+                // matches of the current search with this value, from the facets
+                const facet = document.createElement("span");
+                facet.className = "text-muted";
+                facet.dataset.facet = name;
+                facet.dataset.value = filter_item;
+                cord_body.appendChild(facet);
                 cord_body.appendChild(document.createElement("br"))
             });
+        } else if (entry.type == "text") {
+            const input = document.createElement("input");
+            input.type = "text";
+            input.className = "form-control";
+            input.placeholder = "Part of a file name or path";
+            // the accordion collapse already has "filter-" + name
+            input.id = "filter-" + name + "-input";
+            input.dataset.group = "filter";
+            input.dataset.type = "text";
+            input.dataset.name = name;
+            input.addEventListener("keydown", function (event) {
+                if (event.key === "Enter") {
+                    startNewSearch();
+                }
+            });
+            cord_body.appendChild(input);
         } else {
             if (name == "datetime") {
                 const start_time = entry.min
                 const end_time = entry.max
                 createDatetimeRangeSelector(start_time, end_time, cord_body, name);
             } 
+            if (name == "overlap") {
+                // recorded at any time in the span, unlike datetime which is when the file started
+                createDatetimeRangeSelector(entry.min, entry.max, cord_body, name, "overlap");
+            }
             if( name == "size") {
                 const minBytes = entry.min;
                 const maxBytes = entry.max;
@@ -168,7 +161,7 @@ function updateSearchFilters(msg) {
     })
 }
 
-function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name) {
+function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name, type = "range") {
 
     const start_time = start_time_.replace(" ", "T");
     const end_time = end_time_.replace(" ", "T");
@@ -176,11 +169,11 @@ function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name) {
     // Create label and input for start datetime
     const startLabel = document.createElement('label');
     startLabel.textContent = 'Start Datetime: ';
-    startLabel.setAttribute('for', 'filter-startDatetime');
+    startLabel.setAttribute('for', 'filter-' + name + '-startDatetime');
 
     const startInput = document.createElement('input');
     startInput.type = 'datetime-local';
-    startInput.id = 'filter-startDatetime';
+    startInput.id = 'filter-' + name + '-startDatetime';
     startInput.value = start_time;
     startInput.min = start_time;
     startInput.max = end_time;
@@ -188,11 +181,11 @@ function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name) {
     // Create label and input for end datetime
     const endLabel = document.createElement('label');
     endLabel.textContent = 'End Datetime: ';
-    endLabel.setAttribute('for', 'filter-endDatetime');
+    endLabel.setAttribute('for', 'filter-' + name + '-endDatetime');
 
     const endInput = document.createElement('input');
     endInput.type = 'datetime-local';
-    endInput.id = 'filter-endDatetime';
+    endInput.id = 'filter-' + name + '-endDatetime';
     endInput.value = end_time;
     endInput.min = start_time;
     endInput.max = end_time;
@@ -203,11 +196,13 @@ function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name) {
     cord_body.appendChild(endLabel);
     cord_body.appendChild(endInput);
 
-    cord_body.dataset.type = "range";
+    cord_body.dataset.type = type;
     cord_body.dataset.group = "filter";
     cord_body.dataset.name = name;
     cord_body.dataset.min = start_time.replace("T", " ");
     cord_body.dataset.max = end_time.replace("T", " ");
+    cord_body.dataset.defaultMin = cord_body.dataset.min;
+    cord_body.dataset.defaultMax = cord_body.dataset.max;
 
     startInput.addEventListener('input', updateRangeDisplay);
     endInput.addEventListener('input', updateRangeDisplay);
@@ -218,31 +213,32 @@ function createDatetimeRangeSelector(start_time_, end_time_, cord_body, name) {
         cord_body.dataset.min = start_time.replace("T", " ");
         cord_body.dataset.max = end_time.replace("T", " ");
     }
-
-    function reset() {
-        startInput.value = start_time_.replace(" ", "T");
-        endInput.value = end_time.replace(" ", "T");
-
-        cord_body.dataset.min = start_time_;
-        cord_body.dataset.max = end_time_;
-    }
-    cord_body.reset = reset;
 }
 
 function updateSearchResults(msg) {
     console.log(msg);
+    if (msg.error) {
+        document.getElementById("search-current-page").innerHTML = msg.error;
+        return;
+    }
     const keys = ["select", "project", "site", "robot_name", "datetime", "basename", "path", "hsize"];
 
     search_total_pages = msg.total_pages;
     search_current_page = msg.current_page;
     search_current_index = msg.current_index;
+    search_prev_cursor = msg.prev_cursor;
+    search_next_cursor = msg.next_cursor;
+
+    if (msg.facets) {
+        updateSearchFacets(msg.facets);
+    }
 
     const page_number = document.getElementById("search-current-page")
     const current_page_display = 1 + parseInt(search_current_page)
     page_number.innerHTML = current_page_display + " / " + search_total_pages;
 
-    document.getElementById("search-prev-page").disabled = (search_current_page == 0);
-    document.getElementById("search-next-page").disabled = (search_current_page >= (search_total_pages - 1));
+    document.getElementById("search-prev-page").disabled = (search_current_page == 0) || !search_prev_cursor;
+    document.getElementById("search-next-page").disabled = (search_current_page >= (search_total_pages - 1)) || !search_next_cursor;
 
     const results = msg.results;
 
@@ -366,6 +362,19 @@ function updateSearchResults(msg) {
 
 }
 
+function updateSearchFacets(facets) {
+    $('span[data-facet]').each(function () {
+        const name = $(this).attr('data-facet');
+        const value = $(this).attr('data-value');
+        if (!facets[name]) {
+            $(this).text("");
+            return;
+        }
+        const count = facets[name][value] || 0;
+        $(this).text(" (" + count + ")");
+    });
+}
+
 function readFilter()
 {
     let selected = {};
@@ -383,7 +392,7 @@ function readFilter()
         //selectedUpdateIds.push($(this).attr('id'));
       });    
 
-      $('div[data-group="filter"][data-type="range"').each(function() {
+      $('div[data-group="filter"][data-type="range"]').each(function() {
         const name = $(this).attr('data-name');
         const minVal = $(this).attr('data-min');        
         const maxVal = $(this).attr('data-max');   
@@ -393,24 +402,40 @@ function readFilter()
             "max": maxVal
         }
       })
+
+      // only once narrowed, the full span matches everything
+      $('div[data-group="filter"][data-type="overlap"]').each(function() {
+        const name = $(this).attr('data-name');
+        const start = $(this).attr('data-min');
+        const end = $(this).attr('data-max');
+        if (start != $(this).attr('data-default-min') || end != $(this).attr('data-default-max')) {
+            selected[name] = {
+                "type": "overlap",
+                "start": start,
+                "end": end
+            }
+        }
+      })
+
+      $('input[data-group="filter"][data-type="text"]').each(function() {
+        const name = $(this).attr('data-name');
+        const value = $(this).val().trim();
+        if (value.length > 0) {
+            selected[name] = {
+                "type": "text",
+                "value": value
+            }
+        }
+      })
       return selected;
 }
 
 function startNewSearch() {
     search_current_page = 0;
+    search_prev_cursor = null;
+    search_next_cursor = null;
 
-    filter = readFilter();
-    console.log(filter);
-
-    room = "dashboard-" + window.session_token;
-    msg = {
-        "room": room,
-        "filter": filter,
-        "sort-key": search_sort_name,
-        "sort-direction": search_sort_direction,
-        "results-per-page": results_per_page
-    }
-    socket.emit("search", msg)
+    sendSearch("first", null, 0);
 }
 
 function setSearchSort(name) {
@@ -435,12 +460,32 @@ function setSearchSort(name) {
 }
 
 
+// Back to the span the range control was created with, from its data-default-min and data-default-max.
+function resetRangeFilter(div) {
+    const inputs = div.querySelectorAll("input");
+    const defaults = [div.dataset.defaultMin, div.dataset.defaultMax];
+    for (let i = 0; i < Math.min(inputs.length, 2); i++) {
+        const value = defaults[i];
+        inputs[i].value = inputs[i].type == "datetime-local" ? value.replace(" ", "T") : value;
+        // so the control updates its own display
+        inputs[i].dispatchEvent(new Event("input"));
+    }
+    div.dataset.min = div.dataset.defaultMin;
+    div.dataset.max = div.dataset.defaultMax;
+}
+
 function clearAllFilters() {
     $('input[type="checkbox"][data-group="filter"]:checked').prop('checked', false);  
     
-    $('div[data-group="filter"][data-type="range"').each(function() {
-        $(this)[0].reset()
+    $('div[data-group="filter"][data-type="range"]').each(function() {
+        resetRangeFilter(this);
     })
+
+    $('div[data-group="filter"][data-type="overlap"]').each(function() {
+        resetRangeFilter(this);
+    })
+
+    $('input[data-group="filter"][data-type="text"]').val("");
 }
 
 
@@ -316,6 +316,8 @@ function createFileSizeRangeSelector(minBytes, maxBytes, sizeSelectorDiv, name)
     sizeSelectorDiv.dataset.name = name
     sizeSelectorDiv.dataset.min = minBytes;
     sizeSelectorDiv.dataset.max = maxBytes;
+    sizeSelectorDiv.dataset.defaultMin = minBytes;
+    sizeSelectorDiv.dataset.defaultMax = maxBytes;
 
     function reset() {
         minInput.value = minBytes;
@@ -421,6 +423,8 @@ function createFileDurationRangeSelector(minSeconds, maxSeconds, sizeSelectorDiv
     sizeSelectorDiv.dataset.name = name
     sizeSelectorDiv.dataset.min = minSeconds;
     sizeSelectorDiv.dataset.max = maxSeconds;
+    sizeSelectorDiv.dataset.defaultMin = minSeconds;
+    sizeSelectorDiv.dataset.defaultMax = maxSeconds;
 
     function reset() {
         minInput.value = minSeconds;
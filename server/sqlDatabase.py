@@ -1,66 +1,235 @@
+import base64
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import hashlib
 import json
+import math
 import os
 import pathlib
-from typing import List, Tuple
+import re
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 import humanfriendly
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import redis
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 from server.debug_print import debug_print
 from server.throttledEmit import RedisThrottledEmit
+from server.volumeScanner import VolumeScanner
+
+
+# sort keys of the search, as (expression, type). NULLs sort as "" so every row can be compared to a cursor.
+SEARCH_SORT_KEYS = {
+    "project": ("COALESCE(project, '')", "text"),
+    "site": ("COALESCE(site, '')", "text"),
+    "robot_name": ("COALESCE(robot_name, '')", "text"),
+    "datetime": ("datetime", "timestamp"),
+    "basename": ("basename", "text"),
+    "size": ("size", "bigint"),
+}
+
+
+# columns the search can filter on, and the type of filter each takes. Only these reach the SQL.
+SEARCH_FILTER_COLUMNS = {
+    "project": "discrete",
+    "site": "discrete",
+    "robot_name": "discrete",
+    "datatype": "discrete",
+    "run_name": "discrete",
+    "topics": "discrete",
+    "datetime": "range",
+    "size": "range",
+    "duration": "range",
+    # matches part of the basename, relpath or fullpath
+    "text": "text",
+    # recorded at any time between "start" and "end"
+    "overlap": "overlap",
+}
+
+# the time span of an entry. Must match the expression of data_time_range_idx for the index to be used.
+TIME_RANGE_SQL = "tsrange(LEAST(start_datetime, end_datetime), GREATEST(start_datetime, end_datetime), '[]')"
+
+
+def parse_search_timestamp(value) -> datetime:
+    """Parse a time from a search filter.
 
+    Args:
+        value: "YYYY-MM-DD HH:MM:SS", or any ISO 8601 time. Empty for none.
 
-def build_paginated_query(
-    filters: dict, order_by: str, offset: int, page_size: int, reverse: bool) -> str:
+    Returns:
+        datetime: the time, or None when empty
+
+    Raises:
+        ValueError: the value is not a time
     """
-    Builds a paginated SQL query based on the provided filters, ordering, and pagination settings.
+    if value is None or str(value).strip() == "":
+        return None
+    return datetime.fromisoformat(str(value).strip())
+
+
+def is_valid_search_filter(name: str, filter) -> bool:
+    """Check a search filter from a client before it is used.
+
+    Args:
+        name (str): Column the filter is on
+        filter: The filter, as sent
+
+    Returns:
+        bool: True if the column is in SEARCH_FILTER_COLUMNS, the filter has the type 
+            expected for it, and the fields that type needs.
+    """
+    if not isinstance(filter, dict) or SEARCH_FILTER_COLUMNS.get(name) != filter.get("type"):
+        return False
+    if filter["type"] == "discrete":
+        keys = filter.get("keys")
+        # topics can also match key value pairs.
+        return isinstance(keys, list) or (name == "topics" and isinstance(keys, dict))
+    if filter["type"] == "range":
+        return filter.get("min") is not None and filter.get("max") is not None
+    return True
+
+
+def build_search_conditions(filters: dict) -> Tuple[List[str], list]:
+    """
+    Builds the WHERE conditions for the search filters.
+
+    Values are always parameters. Filters on a column that is not in 
+    SEARCH_FILTER_COLUMNS, of the wrong type for it, or malformed, are ignored,
+    see `is_valid_search_filter`.
+    The text of the conditions only depends on which filters are set, so
+    searches with the same filters share a prepared statement.
 
     Args:
         filters (dict): A dictionary specifying filter conditions for the query.
-        order_by (str): Column name to sort the results by.
-        offset (int): Number of rows to skip before starting to collect the result set.
-        page_size (int): Maximum number of entries to retrieve.
-        reverse (bool): Whether to sort the results in descending order.
 
     Returns:
-        str: A SQL query string with the specified filters, ordering, and pagination settings.
+        Tuple[List[str], list]: The conditions, to be joined with AND, and their parameters.
     """
-    query = "SELECT * FROM data WHERE "
     conditions = []
-
-    # Add conditions based on filters
-    for name, filter in filters.items():
-        if filter["type"] == "discrete":
+    params = []
+
+    for name in sorted(filters):
+        filter = filters[name]
+        if not is_valid_search_filter(name, filter):
+            debug_print(f"Ignoring search filter {name}")
+            continue
+        if name == "topics":
+            continue
+        if filter["type"] == "text":
+            value = str(filter.get("value") or "").strip()
+            if len(value) == 0:
+                continue
+            # a fragment, not a pattern. Escape LIKE wildcards.
+            pattern = "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(basename ILIKE %s OR relpath ILIKE %s OR fullpath ILIKE %s)")
+            params.extend([pattern, pattern, pattern])
+        elif filter["type"] == "overlap":
+            try:
+                start = parse_search_timestamp(filter.get("start"))
+                end = parse_search_timestamp(filter.get("end"))
+            except ValueError:
+                debug_print(f"Ignoring search filter {name}, bad time")
+                continue
+            if start is not None and end is not None and start > end:
+                start, end = end, start
+            # open ended when start or end is missing.
+            # an entry with no times at all would be an unbounded range, and match everything.
+            conditions.append(f"({TIME_RANGE_SQL} && tsrange(%s::timestamp, %s::timestamp, '[]') "
+                              "AND (start_datetime IS NOT NULL OR end_datetime IS NOT NULL))")
+            params.extend([start, end])
+        elif filter["type"] == "discrete":
             # For discrete filters, match any of the specified keys
-            keys = "', '".join(filter["keys"])
-            conditions.append(f"{name} IN ('{keys}')")
+            conditions.append(f"{name} = ANY(%s)")
+            params.append(list(filter["keys"]))
         elif filter["type"] == "range":
             # For range filters, match values between min and max
-            min_val = filter["min"]
-            max_val = filter["max"]
-            if name == "datetime":
-                conditions.append(f"{name} BETWEEN '{min_val}' AND '{max_val}'")
-            else:
-                conditions.append(f"{name} BETWEEN {min_val} AND {max_val}")
+            conditions.append(f"{name} BETWEEN %s AND %s")
+            params.extend([filter["min"], filter["max"]])
+
+    if is_valid_search_filter("topics", filters.get("topics")):
+        keys = filters["topics"]["keys"]
+        if isinstance(keys, dict):
+            for key, val in sorted(keys.items()):
+                # For JSON fields, use the @> operator to check if key-value pairs match
+                conditions.append("topics @> %s")
+                params.append(json.dumps({key: val}))
+        else:
+            # any of the selected topics
+            conditions.append("upload_id IN (SELECT upload_id FROM entry_topics WHERE topic = ANY(%s))")
+            params.append(list(keys))
 
-    # Add conditions for JSON if needed
-    if "topics" in filters:
-        for key, val in filters["topics"]["keys"].items():
-            # For JSON fields, use the @> operator to check if key-value pairs match
-            conditions.append(f'topics @> \'{{"{key}": "{val}"}}\'')
+    return conditions, params
 
-    # Combine all conditions using AND
-    query += " AND ".join(conditions)
-    order_direction = "DESC" if reverse else "ASC"
-    # Add ordering, limit, and offset to the query
-    query += (
-        f" ORDER BY {order_by} {order_direction} LIMIT {page_size} OFFSET {offset};"
-    )
-    return query
 
+def encode_search_cursor(order_by: str, reverse: bool, value, upload_id: str) -> str:
+    """Make the opaque cursor for the position of a search result. 
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat(sep=" ")
+    cursor = {"k": order_by, "r": reverse, "v": value, "id": upload_id}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor: str, order_by: str, reverse: bool) -> Tuple:
+    """Read a cursor from `encode_search_cursor`.
 
-def build_count_query(filters: dict) -> str:
+    Returns:
+        Tuple: (sort value, upload_id), or None if the cursor is not valid for this sort.
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if not isinstance(cursor, dict) or cursor.get("k") != order_by or cursor.get("r") != reverse:
+        return None
+    return cursor.get("v"), cursor.get("id")
+
+
+def build_paginated_query(
+    filters: dict, order_by: str, page_size: int, reverse: bool, after: Tuple = None, backward: bool = False) -> Tuple[str, list]:
+    """
+    Builds a keyset paginated SQL query based on the provided filters, ordering, and position.
+
+    Rows are ordered by the sort key and then upload_id, and the page starts right 
+    after the row at `after`, so the database seeks to it instead of skipping rows.
+
+    Args:
+        filters (dict): A dictionary specifying filter conditions for the query.
+        order_by (str): Sort key, one of SEARCH_SORT_KEYS.
+        page_size (int): Maximum number of entries to retrieve. None for all of them.
+        reverse (bool): Whether to sort the results in descending order.
+        after (Tuple, optional): (sort value, upload_id) of the row before the page. Defaults to None, from the start.
+        backward (bool, optional): Walk the order backward from `after`, for the previous 
+            page. The rows come back in reverse. Defaults to False.
+
+    Returns:
+        Tuple[str, list]: The query and its parameters. Every row has the extra column "sort_value".
+    """
+    expression, cast = SEARCH_SORT_KEYS[order_by]
+    conditions, params = build_search_conditions(filters)
+
+    descending = reverse != backward
+    if after is not None:
+        op = "<" if descending else ">"
+        conditions.append(f"({expression}, upload_id) {op} (%s::{cast}, %s)")
+        params.extend(after)
+
+    query = f"SELECT *, {expression} AS sort_value FROM data"
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+
+    order_direction = "DESC" if descending else "ASC"
+    query += f" ORDER BY {expression} {order_direction}, upload_id {order_direction}"
+    if page_size is not None:
+        query += " LIMIT %s"
+        params.append(int(page_size))
+    return query, params
+
+
+def build_count_query(filters: dict) -> Tuple[str, list]:
     """
     Builds a SQL query to count the number of entries that match the provided filters.
 
@@ -68,50 +237,176 @@ def build_count_query(filters: dict) -> str:
         filters (dict): A dictionary specifying filter conditions for the query.
 
     Returns:
-        str: A SQL query string to count the number of matching entries.
+        Tuple[str, list]: The query and its parameters.
     """
-    query = "SELECT COUNT(*) FROM data WHERE "
-    conditions = []
+    conditions, params = build_search_conditions(filters)
+    query = "SELECT COUNT(*) FROM data"
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params
+
+
+# discrete columns counted per value by a search with facets
+SEARCH_FACET_COLUMNS = ["project", "site", "robot_name", "datatype"]
+
+
+def build_facet_query(filters: dict) -> Tuple[str, list]:
+    """
+    Builds a SQL query that counts the matching entries per value of each 
+    column in SEARCH_FACET_COLUMNS, and in total, in a single pass.
+
+    Args:
+        filters (dict): A dictionary specifying filter conditions for the query.
+
+    Returns:
+        Tuple[str, list]: The query and its parameters. Rows have a "grouping" bit mask 
+            of the columns not grouped, the facet columns, and "count". 
+    """
+    conditions, params = build_search_conditions(filters)
+    columns = ", ".join(SEARCH_FACET_COLUMNS)
+    sets = ", ".join(f"({column})" for column in SEARCH_FACET_COLUMNS)
+
+    query = f"SELECT {columns}, GROUPING({columns}) AS grouping, COUNT(*) AS count FROM data"
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" GROUP BY GROUPING SETS ({sets}, ())"
+    return query, params
+
 
-    # Add conditions based on filters
+def normalize_search_filters(filters: dict) -> str:
+    """A stable text form of the filters, equal for filters that select the same rows.
+
+    Filters that `build_search_conditions` ignores are left out.
+    """
+    normal = {}
     for name, filter in filters.items():
-        if filter["type"] == "discrete":
-            # For discrete filters, match any of the specified keys
-            keys = "', '".join(filter["keys"])
-            conditions.append(f"{name} IN ('{keys}')")
-        elif filter["type"] == "range":
-            # For range filters, match values between min and max
-            min_val = filter["min"]
-            max_val = filter["max"]
-            if name == "datetime":
-                conditions.append(f"{name} BETWEEN '{min_val}' AND '{max_val}'")
-            else:
-                conditions.append(f"{name} BETWEEN {min_val} AND {max_val}")
+        if not is_valid_search_filter(name, filter):
+            continue
+        if filter["type"] == "discrete" and isinstance(filter["keys"], list):
+            normal[name] = {"type": "discrete", "keys": sorted({str(key) for key in filter["keys"]})}
+        else:
+            normal[name] = filter
+    return json.dumps(normal, sort_keys=True, default=str)
+
+
+# tables rebuilt next to the live ones by a full regenerate, and swapped in together.
+SHADOW_TABLES = ["data", "scan_state", "entry_topics"]
+
+
+# Schema changes applied in order by Database._migrate, each as (version, description, statements).
+# Statements run outside of a transaction so indexes can be built CONCURRENTLY, and must be safe 
+# to run again if a migration was interrupted. Never change a shipped entry, add a new version.
+MIGRATIONS = [
+    (1, "indexes for the data table", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_project_date_idx ON data (project, date)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_project_fullpath_idx ON data (project, fullpath)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_site_date_robot_name_idx ON data (site, date, robot_name)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_robot_name_idx ON data (robot_name)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_datetime_idx ON data (datetime)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_size_idx ON data (size)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_topics_idx ON data USING GIN (topics jsonb_path_ops)",
+    ]),
+    (2, "keyset indexes for the search sort keys", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_datetime_idx ON data (datetime, upload_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_size_idx ON data (size, upload_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_basename_idx ON data (basename, upload_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_project_idx ON data ((COALESCE(project, '')), upload_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_site_idx ON data ((COALESCE(site, '')), upload_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_search_robot_name_idx ON data ((COALESCE(robot_name, '')), upload_id)",
+        # covered by the keyset indexes
+        "DROP INDEX CONCURRENTLY IF EXISTS data_datetime_idx",
+        "DROP INDEX CONCURRENTLY IF EXISTS data_size_idx",
+    ]),
+    (3, "indexes for the search filter values", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_datatype_idx ON data (datatype)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_duration_idx ON data (duration)",
+    ]),
+    (4, "fill entry_topics from the topics of existing entries", [
+        """
+        INSERT INTO entry_topics (upload_id, topic, msgtype, count)
+        SELECT d.upload_id, t.key,
+            CASE WHEN jsonb_typeof(t.value) = 'object' THEN COALESCE(t.value->>'msgtype', t.value->>'type') END,
+            CASE jsonb_typeof(t.value) 
+                WHEN 'number' THEN (t.value #>> '{}')::NUMERIC::BIGINT
+                WHEN 'object' THEN CASE WHEN jsonb_typeof(t.value->'count') = 'number' THEN (t.value->>'count')::NUMERIC::BIGINT END
+            END
+        FROM data d, jsonb_each(d.topics) t
+        WHERE jsonb_typeof(d.topics) = 'object'
+        ON CONFLICT DO NOTHING
+        """,
+        """
+        INSERT INTO entry_topics (upload_id, topic)
+        SELECT DISTINCT d.upload_id, t.topic
+        FROM data d, jsonb_array_elements_text(d.topics) t (topic)
+        WHERE jsonb_typeof(d.topics) = 'array'
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+    (5, "trigram indexes for the text search filter", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_basename_trgm_idx ON data USING GIN (basename gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_relpath_trgm_idx ON data USING GIN (relpath gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS data_fullpath_trgm_idx ON data USING GIN (fullpath gin_trgm_ops)",
+    ]),
+    (6, "index on the time span of entries for overlap queries", [
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS data_time_range_idx ON data USING GIST (({TIME_RANGE_SQL}))",
+    ]),
+]
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """A connection that remembers the statements prepared on it, see `Database._execute_prepared`.
+
+    Kept on the connection, so they go with it when it is closed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
 
-    # Add conditions for JSON if needed
-    if "topics" in filters:
-        for key, val in filters["topics"]["keys"].items():
-            # For JSON fields, use the @> operator to check if key-value pairs match
-            conditions.append(f'topics @> \'{{"{key}": "{val}"}}\'')
 
-    # Combine all conditions with AND
-    query += " AND ".join(conditions) + ";"
-    return query
+class KeepIdleConnectionPool(ThreadedConnectionPool):
+    """A ThreadedConnectionPool that keeps up to maxconn idle connections.
+
+    The base pool closes a returned connection once minconn are idle, so most 
+    borrows would open a new connection.
+    """
+    def _putconn(self, conn, key=None, close=False):
+        # called with the pool lock held.
+        minconn = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
 
 
 class Database:
     """An interface to the SQL database.  
 
+    Connections are borrowed from a per-process pool owned by this instance.
+    Use `_connection()` rather than `connect()` for anything that talks to the database.
+
     Environment:
         REDIS_HOST: default "localhost"
+        DB_HOST: default "localhost"
+        DB_PORT: default 5432
+        DB_POOL_MIN: connections opened when the pool is created. default 1
+        DB_POOL_MAX: most connections the pool will hand out at once, and keep open when idle. default 10
+        DB_POOL_CHECK_S: idle seconds before a pooled connection is pinged on checkout. default 30
+        SCAN_WORKERS: directories scanned at once by regenerate. default is the executor default
+        SEARCH_TIMEOUT_MS: longest a search query may run before Postgres cancels it. 0 for no limit. default 30000
+        SWAP_LOCK_TIMEOUT_MS: longest a rebuild waits for readers to let go of the live tables, per try. default 2000
+        SWAP_ATTEMPTS: tries to swap in a rebuilt table before giving up. default 60
 
     """
-    def __init__(self, volume_map: dict, blackout: list) -> None:
+    def __init__(self, volume_map: dict, blackout: list, init: bool = True) -> None:
         """Create an instance of the database interface
 
         Args:
             volume_map (dict): Mapping of project name to complete volume path
             blackout (list): List of directories to avoid scanning. Can be a part of a directory, and will still match
+            init (bool, optional): Create and migrate the schema, and set runs. Processes that only 
+                read, such as the frontend, can skip it. Defaults to True.
         """
         self.m_username = "sts"
         self.m_password = "mypassword"
@@ -120,6 +415,28 @@ class Database:
         self.m_blackout = blackout
         self.m_cache = {}
 
+        self.m_pool = None
+        self.m_pool_pid = None
+        self.m_pool_slots = None
+        self.m_pool_lock = threading.Lock()
+        self.m_pool_min = int(os.environ.get("DB_POOL_MIN", 1))
+        self.m_pool_max = max(self.m_pool_min, int(os.environ.get("DB_POOL_MAX", 10)))
+        self.m_pool_check_s = float(os.environ.get("DB_POOL_CHECK_S", 30))
+        self.m_last_used = {}
+
+        self.m_search_timeout_ms = int(os.environ.get("SEARCH_TIMEOUT_MS", 30000))
+        self.m_swap_lock_timeout_ms = int(os.environ.get("SWAP_LOCK_TIMEOUT_MS", 2000))
+        self.m_swap_attempts = max(1, int(os.environ.get("SWAP_ATTEMPTS", 60)))
+        # connection running the current query of each search, by search key, as (seq, conn)
+        self.m_searches = {}
+        self.m_searches_lock = threading.Lock()
+
+        redis_host = os.environ.get("REDIS_HOST", "localhost")
+        self.redis = redis.StrictRedis(host=redis_host, port=6379, db=0)
+
+        scan_workers = os.environ.get("SCAN_WORKERS")
+        self.m_scan_workers = int(scan_workers) if scan_workers else None
+
         self.m_time_format = {
             "date": "%Y-%m-%d",
             "datetime": "%Y-%m-%d %H:%M:%S",
@@ -127,26 +444,155 @@ class Database:
             "end_datetime": "%Y-%m-%d %H:%M:%S",
         }
 
-        self.init_db()
-        self._set_runs()
+        if init:
+            self.init_db()
+            self._set_runs(incremental=True)
+
+    def _connect_args(self) -> dict:
+        return {
+            "dbname": self.m_db_name,
+            "user": self.m_username,
+            "password": self.m_password,
+            "host": os.environ.get("DB_HOST", "localhost"),
+            "port": os.environ.get("DB_PORT", 5432),
+            "connection_factory": PooledConnection,
+        }
 
     def connect(self):
-        db_host = os.environ.get("DB_HOST", "localhost")
-        db_port = os.environ.get("DB_PORT", 5432)
-        conn = psycopg2.connect(
-            dbname=self.m_db_name,
-            user=self.m_username,
-            password=self.m_password,
-            host=db_host,
-            port=db_port
-        )
+        """Open a new, unpooled connection. The caller owns it and must close it.
+        """
+        conn = psycopg2.connect(**self._connect_args())
         return conn
 
-    def init_db(self):
-        conn = self.connect()
-        cur = conn.cursor()
+    def _get_pool(self) -> Tuple[KeepIdleConnectionPool, threading.BoundedSemaphore]:
+        """Get the connection pool for this process, creating it on first use.
 
-        with self.connect() as conn:
+        The pool is rebuilt after a fork, since the parent's sockets can not be shared. 
+        If the database is unreachable the error is raised, and the next call tries again.
+        """
+        with self.m_pool_lock:
+            if self.m_pool is None or self.m_pool_pid != os.getpid():
+                debug_print(f"Creating connection pool {self.m_pool_min}-{self.m_pool_max}")
+                self.m_pool = KeepIdleConnectionPool(self.m_pool_min, self.m_pool_max, **self._connect_args())
+                self.m_pool_pid = os.getpid()
+                # the pool raises when exhausted, the semaphore makes borrowers wait instead.
+                self.m_pool_slots = threading.BoundedSemaphore(self.m_pool_max)
+                self.m_last_used = {}
+            return self.m_pool, self.m_pool_slots
+
+    def _is_healthy(self, conn) -> bool:
+        """Check a pooled connection before handing it out. 
+
+        Connections used within the last DB_POOL_CHECK_S seconds are trusted, 
+        older ones are pinged.
+        """
+        if conn.closed:
+            return False
+        last_used = self.m_last_used.get(id(conn))
+        if last_used is not None and time.time() - last_used < self.m_pool_check_s:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error as e:
+            debug_print(f"Dropping stale connection: {e}")
+            return False
+        return True
+
+    def _checkout(self, pool:KeepIdleConnectionPool):
+        # each stale connection is discarded, so after m_pool_max tries the pool opens a fresh one.
+        for _ in range(self.m_pool_max):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._forget_connection(conn)
+            pool.putconn(conn, close=True)
+        return pool.getconn()
+
+    @contextmanager
+    def _connection(self):
+        """Borrow a connection from the pool.
+
+        Commits when the block exits cleanly and rolls back on an exception.
+        Connections that fail with an OperationalError or InterfaceError are 
+        closed rather than returned, so the next borrower reconnects.
+
+        Yields:
+            connection: a psycopg2 connection
+        """
+        pool, slots = self._get_pool()
+        slots.acquire()
+        conn = None
+        broken = False
+        try:
+            conn = self._checkout(pool)
+            yield conn
+            conn.commit()
+        except (psycopg2.extensions.QueryCanceledError, psycopg2.errors.LockNotAvailable):
+            # OperationalErrors, but the connection is still good.
+            conn.rollback()
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except BaseException:
+            # BaseException too, a generator closed early holding a connection raises GeneratorExit.
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                broken = broken or bool(conn.closed)
+                if not broken:
+                    self.m_last_used[id(conn)] = time.time()
+                pool.putconn(conn, close=broken)
+                # the pool may also have closed it.
+                if conn.closed:
+                    self._forget_connection(conn)
+            slots.release()
+
+    def _forget_connection(self, conn):
+        # a new connection can reuse the id of a closed one.
+        self.m_last_used.pop(id(conn), None)
+
+    def _execute_prepared(self, cur, query:str, params:list):
+        """Execute a query as a server side prepared statement.
+
+        The statement is prepared the first time its text is run on a connection, 
+        and executed by name after that, so it is not planned again. The names 
+        prepared are kept on the connection, see `PooledConnection`.
+
+        Args:
+            cur (cursor): Open cursor, of a `PooledConnection`
+            query (str): Query with %s placeholders, and no other % characters
+            params (list): Parameters for the placeholders
+        """
+        name = "stmt_" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+        prepared = cur.connection.prepared
+        if name not in prepared:
+            parts = query.split("%s")
+            positional = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+            cur.execute(f"PREPARE {name} AS {positional}")
+            prepared.add(name)
+
+        if len(params) == 0:
+            cur.execute(f"EXECUTE {name}")
+        else:
+            placeholders = ", ".join(["%s"] * len(params))
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+    def close(self):
+        """Close every pooled connection. The pool is recreated on next use.
+        """
+        with self.m_pool_lock:
+            if self.m_pool is not None and self.m_pool_pid == os.getpid():
+                self.m_pool.closeall()
+            self.m_pool = None
+            self.m_last_used = {}
+
+    def init_db(self):
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 # Create the table if it doesn't exist
                 create_data_table_query = """
@@ -187,84 +633,389 @@ class Database:
                     """
                     cur.execute(create_table_query)
 
+                # what regenerate found in each directory, so the next one only reads changed directories.
+                create_scan_state_query = """
+                CREATE TABLE IF NOT EXISTS scan_state (
+                    path TEXT PRIMARY KEY,
+                    mtime BIGINT,
+                    subdirs JSONB,
+                    sidecars JSONB
+                );
+                """
+                cur.execute(create_scan_state_query)
+
+                # (site, date, robot_name) groups changed since runs were last set.
+                create_run_dirty_query = """
+                CREATE TABLE IF NOT EXISTS run_dirty (
+                    site VARCHAR(255),
+                    date DATE,
+                    robot_name VARCHAR(255)
+                );
+                """
+                cur.execute(create_run_dirty_query)
+
+                # totals of every run and datatype, kept up to date with the data table.
+                create_stats_rollup_query = """
+                CREATE TABLE IF NOT EXISTS stats_rollup (
+                    project VARCHAR(255),
+                    date DATE,
+                    run_name VARCHAR(255),
+                    datatype VARCHAR(10),
+                    total_size BIGINT,
+                    count BIGINT,
+                    start_datetime TIMESTAMP,
+                    end_datetime TIMESTAMP
+                );
+                """
+                cur.execute(create_stats_rollup_query)
+                cur.execute("CREATE INDEX IF NOT EXISTS stats_rollup_project_date_idx ON stats_rollup (project, date)")
+
+                # one row per topic of an entry, for topic filters and the topic list.
+                create_entry_topics_query = """
+                CREATE TABLE IF NOT EXISTS entry_topics (
+                    upload_id VARCHAR(255),
+                    topic TEXT,
+                    msgtype TEXT,
+                    count BIGINT,
+                    PRIMARY KEY (upload_id, topic)
+                );
+                """
+                cur.execute(create_entry_topics_query)
+                cur.execute("CREATE INDEX IF NOT EXISTS entry_topics_topic_idx ON entry_topics (topic, upload_id)")
+
+                # bumped by every change to the data table, cached results are only valid for one generation.
+                create_generation_query = """
+                CREATE TABLE IF NOT EXISTS data_generation (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    generation BIGINT NOT NULL
+                );
+                """
+                cur.execute(create_generation_query)
+                cur.execute("INSERT INTO data_generation (id, generation) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING")
+
+                cur.execute("SELECT NOT EXISTS(SELECT 1 FROM stats_rollup) AND EXISTS(SELECT 1 FROM data)")
+                if cur.fetchone()[0]:
+                    debug_print("Building stats_rollup")
+                    self._refresh_rollup(cur)
+
             conn.commit()
 
+        self._migrate()
+
+    def _migrate(self):
+        """Bring the schema up to the last version in MIGRATIONS.
+
+        Every process runs this at startup. An advisory lock lets one of them 
+        apply the missing versions while the others poll for it, and indexes are built 
+        CONCURRENTLY so the tables stay usable during an upgrade.
+        """
+        latest = MIGRATIONS[-1][0]
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT now()
+                );
+                """)
+                cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                if cur.fetchone()[0] >= latest:
+                    return
+
+        # indexes the migrations build, the only ones cleaned up here.
+        migration_indexes = []
+        for _, _, statements in MIGRATIONS:
+            for statement in statements:
+                match = re.match(r"CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)", statement)
+                if match:
+                    migration_indexes.append(match.group(1))
+
+        conn = self.connect()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                # polled rather than waited on. A session blocked in pg_advisory_lock holds a snapshot, 
+                # and CREATE INDEX CONCURRENTLY in the session holding the lock would wait for it.
+                while True:
+                    cur.execute("SELECT pg_try_advisory_lock(hashtext('schema_migrations'))")
+                    if cur.fetchone()[0]:
+                        break
+                    time.sleep(1)
+
+                cur.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cur.fetchall()}
+
+                # an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index that IF NOT EXISTS would keep.
+                cur.execute("""
+                    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid 
+                    WHERE NOT i.indisvalid AND pg_table_is_visible(c.oid) AND c.relname = ANY(%s)
+                """, (migration_indexes,))
+                for (name,) in cur.fetchall():
+                    debug_print(f"Dropping invalid index {name}")
+                    cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+                for version, description, statements in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    debug_print(f"Migrating to version {version}: {description}")
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+        finally:
+            # closing the session releases the advisory lock.
+            conn.close()
+
     def load_from_json(self, root):
         filename = pathlib.Path(root) / "database.json"
         if filename.exists():
             with filename.open("r") as fid:
                 database = json.load(fid)
-            for entry in database["data"]:
-                self.add_entry(entry)
+            self.add_entries(database["data"])
 
         for name in self.m_volume_map:
             self.add_project(name, "")
         self._set_runs()
 
-    def _drop_data_table(self):
-        with self.connect() as conn:
+    def _create_shadow(self):
+        """Create an empty shadow of every table in SHADOW_TABLES, with the schema and indexes of the live one.
+        """
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                query = "DROP TABLE IF EXISTS data"
-                cur.execute(query)
-                conn.commit()
+                for table in SHADOW_TABLES:
+                    cur.execute(f"DROP TABLE IF EXISTS {table}_shadow")
+                    cur.execute(f"CREATE TABLE {table}_shadow (LIKE {table} INCLUDING ALL)")
 
-    def regenerate(self, event:str=None, room:str=None):
-        """Regenerate the database, send messages to a Redis redirection. 
+    def _drop_shadow(self):
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                for table in SHADOW_TABLES:
+                    cur.execute(f"DROP TABLE IF EXISTS {table}_shadow")
+
+    def _index_names(self, cur, table:str) -> Dict[str, str]:
+        # maps an index definition, without its name and table, to the index name.
+        query = "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s"
+        cur.execute(query, (table,))
+        names = {}
+        for name, definition in cur.fetchall():
+            unique = definition.startswith("CREATE UNIQUE")
+            names[(unique, definition.split(" USING ", 1)[1])] = name
+        return names
+
+    def _swap_shadow(self):
+        """Replace the tables in SHADOW_TABLES with their shadows in one transaction.
+
+        Readers keep using the old tables until the commit. The shadow indexes
+        are renamed to the names of the indexes they replace, and stats_rollup
+        is rebuilt in the same transaction.
+
+        A long reader, such as an export, would hold up the locks, and every reader 
+        after it would queue behind the swap. So each try waits at most 
+        SWAP_LOCK_TIMEOUT_MS for the locks, then lets readers through before the next.
+
+        Raises:
+            psycopg2.errors.LockNotAvailable: the locks could not be taken in SWAP_ATTEMPTS tries.
+        """
+        for attempt in range(1, self.m_swap_attempts + 1):
+            try:
+                with self._connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SET LOCAL lock_timeout = %s", (self.m_swap_lock_timeout_ms,))
+                        for table in SHADOW_TABLES:
+                            cur.execute(f"LOCK TABLE {table}, {table}_shadow IN ACCESS EXCLUSIVE MODE")
+                        # the locks are held, the rest does not wait on readers.
+                        cur.execute("SET LOCAL lock_timeout = 0")
+
+                        for table in SHADOW_TABLES:
+                            shadow = f"{table}_shadow"
+                            old_names = self._index_names(cur, table)
+                            new_names = self._index_names(cur, shadow)
+
+                            cur.execute(f"DROP TABLE {table}")
+                            cur.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+                            for key, name in new_names.items():
+                                if key in old_names and old_names[key] != name:
+                                    cur.execute(f'ALTER INDEX "{name}" RENAME TO "{old_names[key]}"')
+
+                        self._refresh_rollup(cur)
+                        self._bump_generation(cur)
+                break
+            except psycopg2.errors.LockNotAvailable:
+                if attempt == self.m_swap_attempts:
+                    raise
+                debug_print(f"Tables busy, swap try {attempt} of {self.m_swap_attempts}")
+                time.sleep(1)
+        debug_print("Swapped in the new data table")
+
+    def regenerate(self, event:str=None, room:str=None, full:bool=False):
+        """Sync the database with the .metadata files on the volumes, send messages to a Redis redirection. 
+
+        Only directories whose mtime changed since the last scan are read. New entries are 
+        added, and the entries of .metadata files or directories that are gone are removed.
+
+        With no previous scan, or when `full` is set, the data table is rebuilt. The new 
+        table is built next to the live one and swapped in when complete, so searches and
+        downloads keep working from the old data in the meantime. A rebuild that could not
+        read every directory, or that failed, is dropped and the live tables are kept. Entries 
+        added to the live table during the rebuild go with it, so an incremental scan runs 
+        right after the swap to find their .metadata files again.
 
         Args:
             event (str, optional): Websocket Event for ui. Defaults to None.
             room (str, optional): room to send events, None for all. Defaults to None.
+            full (bool, optional): Ignore the previous scan and rebuild. Defaults to False.
         """
-        # init db without file to create new db.
-        self._drop_data_table()
-        self.init_db()
+        state = {}
+        if not full:
+            state = self._load_scan_state()
+
+        rebuild = len(state) == 0
+        table = "data"
+        state_table = "scan_state"
+        if rebuild:
+            self._create_shadow()
+            table = "data_shadow"
+            state_table = "scan_state_shadow"
 
         emit = None
         if event:
             emit = RedisThrottledEmit(event, room=room)
 
-        for project in sorted(self.m_volume_map):
-            volume_root = self.m_volume_map[project]
+        swapped = False
+        try:
+            scan_state = {path: (item["mtime"], item["subdirs"]) for path, item in state.items()}
+            scanner = VolumeScanner(self.m_volume_map, self.m_blackout, state=scan_state, max_workers=self.m_scan_workers, emit=emit)
+            complete = self._sync_scan(scanner.scan(), state, table=table, state_table=state_table)
 
-            debug_print((project, volume_root))
-            for root, _, files in os.walk(volume_root):
-                skip = None
-                for b in self.m_blackout:
-                    if b in root:
-                        skip = b
-                if skip:
-                    # debug_print(f"Skipping because {root} matches {skip}")
-                    if emit:
-                        emit.emit(f"Skipping because {root} matches {skip}")
+            if rebuild and not complete:
+                # the new table is missing what could not be read, the live tables are kept.
+                debug_print("Rebuild incomplete, keeping the current data")
+                if emit:
+                    emit.emit("Rebuild incomplete, some directories could not be read. Keeping the current data.")
+                return
+
+            self._set_runs(table=table, incremental=not rebuild)
+            if rebuild:
+                self._swap_shadow()
+                swapped = True
+
+                # uploads during the rebuild changed their directories since they were read.
+                state = self._load_scan_state()
+                scan_state = {path: (item["mtime"], item["subdirs"]) for path, item in state.items()}
+                scanner = VolumeScanner(self.m_volume_map, self.m_blackout, state=scan_state, max_workers=self.m_scan_workers, emit=emit)
+                self._sync_scan(scanner.scan(), state)
+                self._set_runs(incremental=True)
+        finally:
+            if rebuild and not swapped:
+                self._drop_shadow()
+            if emit:
+                emit.close()
+
+    def _load_scan_state(self) -> Dict[str, dict]:
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT path, mtime, subdirs, sidecars FROM scan_state")
+                return {row["path"]: row for row in cur}
 
-                    continue
+    def _sync_scan(self, results:Iterable[dict], state:Dict[str, dict], table:str="data", state_table:str="scan_state", batch_size:int=5000) -> bool:
+        """Apply the results of a VolumeScanner to the data and scan_state tables.
 
-                debug_print(root)
+        Changed directories are written a batch at a time, each batch in one transaction
+        together with its scan state, so an interrupted scan can be resumed. Directories 
+        from the previous scan that were not reached this time (removed, or blacked out)
+        are dropped at the end, only if the scan finished. If `results` raises, what was 
+        read is written and the error is raised again, without removing anything.
 
-                if emit:
-                    emit.emit(f"Scanning {root}")
-                
-                for basename in files:
-                    if basename == "database.json":
-                        continue
-                    if basename.endswith(".metadata"):
-                        base = ".".join(basename.split(".")[:-1])
-                        filename = os.path.join(root, base)
-                        if not os.path.exists(filename):
-                            continue
-
-                        entry = json.load(open(os.path.join(root, basename), "r"))
-                        entry["localpath"] = filename
-                        entry["dirroot"] = volume_root
-                        entry["date"] = entry.get(
-                            "date", entry["datetime"].split(" ")[0]
-                        )
-                        entry["md5"] = entry.get("md5", "0")
-                        self.add_entry(entry)
-        if emit:
-            emit.close()
+        Args:
+            results (Iterable[dict]): Directory results from `VolumeScanner.scan`
+            state (Dict[str, dict]): scan_state rows from the previous scan, by path
+            table (str, optional): Table to write entries to. Defaults to "data".
+            state_table (str, optional): Table to write the scan state to. Defaults to "scan_state".
+            batch_size (int, optional): Entries per transaction. Defaults to 5000.
 
-        self._set_runs()
+        Returns:
+            bool: True if every directory was read, False if some could not be.
+        """
+        visited = set()
+        failed = []
+        # upload_ids found this scan. An entry that moved directory must not be removed with its old sidecar.
+        seen_ids = set()
+        entries = []
+        removed = []
+        dirs = []
+
+        def flush():
+            added = {}
+            try:
+                with self._connection() as conn:
+                    with conn.cursor() as cur:
+                        self._delete_entries(cur, [uid for uid in removed if uid not in seen_ids], table=table)
+                        self._insert_entries(cur, entries, table=table, added=added)
+                        query = f"""
+                            INSERT INTO {state_table} (path, mtime, subdirs, sidecars) VALUES %s
+                            ON CONFLICT (path) DO UPDATE SET 
+                                mtime = EXCLUDED.mtime, subdirs = EXCLUDED.subdirs, sidecars = EXCLUDED.sidecars
+                        """
+                        execute_values(cur, query, dirs)
+                self._cache_names(added)
+                debug_print(f"Synced {len(dirs)} directories, {len(entries)} entries")
+            finally:
+                # a batch that failed is not written again. Its directories have no 
+                # scan state, so the next scan reads them again.
+                entries.clear()
+                removed.clear()
+                dirs.clear()
+
+        try:
+            for result in results:
+                path = result["path"]
+                visited.add(path)
+                if result["status"] == "failed":
+                    failed.append(path)
+                    continue
+                if result["status"] == "unchanged":
+                    continue
+
+                sidecars = {}
+                for entry in result["entries"]:
+                    sidecars[os.path.basename(entry["localpath"])] = entry.get("upload_id")
+                    seen_ids.add(entry.get("upload_id"))
+
+                old_sidecars = state.get(path, {}).get("sidecars") or {}
+                removed.extend(uid for name, uid in old_sidecars.items() if sidecars.get(name) != uid)
+
+                entries.extend(result["entries"])
+                dirs.append((path, result["mtime"], json.dumps(result["subdirs"]), json.dumps(sidecars)))
+                if len(entries) >= batch_size or len(dirs) >= batch_size:
+                    flush()
+        except Exception:
+            # the scan did not finish. What was read is kept, but nothing is removed, 
+            # the directories it did not reach are not known to be gone.
+            # empty if flush itself failed.
+            if len(dirs) > 0:
+                flush()
+            raise
+
+        if len(dirs) > 0:
+            flush()
+
+        # only reached when the scan finished. 
+        # directories below one that could not be read are kept as they were.
+        failed_prefixes = tuple(path.rstrip("/") + "/" for path in failed)
+        gone = [path for path in state if path not in visited and not path.startswith(failed_prefixes)]
+        if len(gone) == 0:
+            return len(failed) == 0
+
+        gone_ids = set()
+        for path in gone:
+            gone_ids.update((state[path].get("sidecars") or {}).values())
+
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                self._delete_entries(cur, [uid for uid in gone_ids if uid not in seen_ids], table=table)
+                cur.execute(f"DELETE FROM {state_table} WHERE path = ANY(%s)", (gone,))
+        debug_print(f"Removed {len(gone)} directories")
+        return len(failed) == 0
 
     def update_volume_map(self, volume_map:dict):
         self.m_volume_map = volume_map
@@ -281,7 +1032,7 @@ class Database:
         Returns:
             bool: True if it does, false if not
         """
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 query = "SELECT EXISTS(SELECT 1 FROM data WHERE upload_id = %s)"
                 cur.execute(query, (upload_id,))
@@ -291,7 +1042,7 @@ class Database:
         return exists
 
     def find_existing_ids(self, upload_ids: List[str]) -> List[str]:
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 # Use the SQL IN clause with a tuple of upload_ids
                 query = "SELECT upload_id FROM data WHERE upload_id = ANY(%s)"
@@ -313,7 +1064,7 @@ class Database:
             List[str]: _description_
         """
         ids = []
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 for project, filename in names:
                     filename = filename.strip("/")
@@ -325,21 +1076,27 @@ class Database:
         return ids
 
     def add_entry(self, entry:dict):
-        if entry.get("upload_id") is None or entry["upload_id"] == "None":
-            return
+        self.add_entries([entry])
 
-        debug_print(f"Add {entry['upload_id']}")
-        # skip if entry already exists.
-        if self.check_upload_id(entry["upload_id"]):
-            return
+    def _prepare_entry(self, entry:dict) -> tuple:
+        """Fill in the defaults for an entry and build its row for the data table.
 
-        self.add_robot_name(entry["robot_name"], "")
-        self.add_project(entry["project"], "")
+        Args:
+            entry (dict): Entry read from a .metadata file or an upload. Modified in place.
 
-        if entry["site"] and len(entry["site"]) > 0:
-            self.add_site(entry["site"], "")
+        Returns:
+            tuple: Values in the column order of `add_entries`
 
-        entry["datatype"] = entry.get("datatype").replace(".", "")
+        Raises:
+            KeyError: a required field is missing
+            ValueError: a time is not "YYYY-MM-DD HH:MM:SS"
+            (TypeError, AttributeError): a field has the wrong type
+        """
+        # may be missing, everything else is required.
+        for key in ["robot_name", "site", "run_name", "topics"]:
+            entry.setdefault(key, None)
+
+        entry["datatype"] = entry["datatype"].replace(".", "")
         if entry["run_name"] is None or len(entry["run_name"]) < 1:
             entry["run_name"] = "run_no_name"
 
@@ -354,45 +1111,266 @@ class Database:
         ) - datetime.strptime(entry["start_datetime"], "%Y-%m-%d %H:%M:%S")
         entry["duration"] = duration.seconds
 
-        with self.connect() as conn:
+        return (
+            entry["project"],
+            entry["robot_name"],
+            entry["run_name"],
+            entry["datatype"],
+            entry["relpath"],
+            entry["basename"],
+            entry.get("fullpath", ""),
+            entry["size"],
+            entry["site"],
+            entry["date"],
+            entry["datetime"],
+            entry["start_datetime"],
+            entry["end_datetime"],
+            entry["upload_id"],
+            entry["dirroot"],
+            entry["md5"],
+            json.dumps(entry["topics"]),
+            entry["localpath"],
+            entry["duration"],
+        )
+
+    def add_entries(self, entries:Iterable[dict], batch_size:int=5000) -> int:
+        """Add many entries to the data table.
+
+        Entries are loaded `batch_size` at a time, one transaction per batch. 
+        The robot, project and site names of a batch are upserted once, and 
+        entries whose upload_id already exists are skipped.
+
+        Args:
+            entries (Iterable[dict]): Entries to add. Can be a generator.
+            batch_size (int, optional): Rows per transaction. Defaults to 5000.
+
+        Returns:
+            int: Number of entries inserted
+        """
+        inserted = 0
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                inserted += self._insert_batch(batch)
+                batch = []
+
+        if len(batch) > 0:
+            inserted += self._insert_batch(batch)
+        return inserted
+
+    def _insert_batch(self, entries:List[dict]) -> int:
+        added = {}
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                query = """
-                    INSERT INTO data (
-                        project, robot_name, run_name, datatype, relpath, basename, fullpath,
-                        size, site, date, datetime, start_datetime, end_datetime, upload_id,
-                        dirroot, md5, topics, localpath, duration
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
+                inserted = self._insert_entries(cur, entries, added=added)
+        self._cache_names(added)
+
+        debug_print(f"Added {len(inserted)} of {len(entries)}")
+        return len(inserted)
+
+    def _insert_entries(self, cur, entries:List[dict], table:str="data", added:Dict[str, Set[str]] = None) -> List[str]:
+        """Insert entries as part of the caller's transaction. Existing upload_ids are skipped.
+
+        Entries that `_prepare_entry` rejects are logged and skipped.
+
+        Args:
+            cur (cursor): Open cursor
+            entries (List[dict]): Entries to add. Modified in place by `_prepare_entry`.
+            table (str, optional): "data", or "data_shadow" during a rebuild. Defaults to "data".
+            added (Dict[str, Set[str]], optional): Filled with the new robot, project and site 
+                names, see `_upsert_names`. Defaults to None.
+
+        Returns:
+            List[str]: upload_ids of the rows inserted
+        """
+        names = {"robot_names": set(), "projects": set(), "sites": set()}
+        rows = {}
+        entries_by_id = {}
+        for entry in entries:
+            if entry.get("upload_id") is None or entry["upload_id"] == "None":
+                continue
+            if entry["upload_id"] in rows:
+                continue
+
+            try:
+                rows[entry["upload_id"]] = self._prepare_entry(entry)
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                # one bad entry must not roll back the batch.
+                debug_print(f"Skipping entry {entry['upload_id']} {entry.get('localpath')}: {e!r}")
+                continue
+            entries_by_id[entry["upload_id"]] = entry
+
+            if entry["robot_name"]:
+                names["robot_names"].add(entry["robot_name"])
+            if entry["project"]:
+                names["projects"].add(entry["project"])
+            if entry["site"] and len(entry["site"]) > 0:
+                names["sites"].add(entry["site"])
+
+        query = f"""
+            INSERT INTO {table} (
+                project, robot_name, run_name, datatype, relpath, basename, fullpath,
+                size, site, date, datetime, start_datetime, end_datetime, upload_id,
+                dirroot, md5, topics, localpath, duration
+            ) VALUES %s
+            ON CONFLICT (upload_id) DO NOTHING
+            RETURNING upload_id
+        """
+
+        if len(rows) == 0:
+            return []
+
+        self._upsert_names(cur, names, added)
+        inserted = [row[0] for row in execute_values(cur, query, list(rows.values()), page_size=1000, fetch=True)]
+
+        topics = []
+        for uid in inserted:
+            topics.extend(self._topic_rows(uid, entries_by_id[uid].get("topics")))
+        if len(topics) > 0:
+            topics_table = "entry_topics_shadow" if table == "data_shadow" else "entry_topics"
+            query = f"INSERT INTO {topics_table} (upload_id, topic, msgtype, count) VALUES %s ON CONFLICT DO NOTHING"
+            execute_values(cur, query, topics, page_size=5000)
 
-                cur.execute(
-                    query,
-                    (
-                        entry["project"],
-                        entry["robot_name"],
-                        entry["run_name"],
-                        entry["datatype"],
-                        entry["relpath"],
-                        entry["basename"],
-                        entry.get("fullpath", ""),
-                        entry["size"],
-                        entry["site"],
-                        entry["date"],
-                        entry["datetime"],
-                        entry["start_datetime"],
-                        entry["end_datetime"],
-                        entry["upload_id"],
-                        entry["dirroot"],
-                        entry["md5"],
-                        json.dumps(entry["topics"]),
-                        entry["localpath"],
-                        entry["duration"],
-                    ),
-                )
-
-                conn.commit()
+        if table == "data":
+            # row is in the column order above, project, robot_name, site and date.
+            self._mark_runs_dirty(cur, {(rows[uid][8], rows[uid][9], rows[uid][1]) for uid in inserted})
+            self._refresh_rollup(cur, {(rows[uid][0], rows[uid][9]) for uid in inserted})
+            if len(inserted) > 0:
+                self._bump_generation(cur)
+        return inserted
+
+    def _delete_entries(self, cur, upload_ids:List[str], table:str="data"):
+        """Delete entries as part of the caller's transaction.
+
+        Args:
+            cur (cursor): Open cursor
+            upload_ids (List[str]): upload_ids to remove
+            table (str, optional): "data", or "data_shadow" during a rebuild. Defaults to "data".
+        """
+        if len(upload_ids) == 0:
+            return
+        cur.execute(f"DELETE FROM {table} WHERE upload_id = ANY(%s) RETURNING project, site, date, robot_name", (list(upload_ids),))
+        deleted = cur.fetchall()
+        topics_table = "entry_topics_shadow" if table == "data_shadow" else "entry_topics"
+        cur.execute(f"DELETE FROM {topics_table} WHERE upload_id = ANY(%s)", (list(upload_ids),))
+        if table == "data":
+            self._mark_runs_dirty(cur, {(site, date, robot_name) for _, site, date, robot_name in deleted})
+            self._refresh_rollup(cur, {(project, date) for project, _, date, _ in deleted})
+            if len(deleted) > 0:
+                self._bump_generation(cur)
+
+    def _topic_rows(self, upload_id:str, topics) -> List[tuple]:
+        """Rows of entry_topics for the topics of an entry.
+
+        Args:
+            upload_id (str): The entry
+            topics (dict|list): Maps topic to its message count, or to a dict with 
+                "count" and "msgtype". A list of topic names is also accepted.
+
+        Returns:
+            List[tuple]: (upload_id, topic, msgtype, count)
+        """
+        rows = []
+        if isinstance(topics, dict):
+            for topic, value in topics.items():
+                msgtype = None
+                count = None
+                if isinstance(value, dict):
+                    msgtype = value.get("msgtype", value.get("type"))
+                    value = value.get("count")
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    count = int(value)
+                rows.append((upload_id, str(topic), msgtype, count))
+        elif isinstance(topics, list):
+            for topic in set(map(str, topics)):
+                rows.append((upload_id, topic, None, None))
+        return rows
+
+    def _refresh_rollup(self, cur, groups:Set[Tuple[str, str]]=None):
+        """Recompute stats_rollup for some (project, date) groups, as part of the caller's transaction.
+
+        Args:
+            cur (cursor): Open cursor
+            groups (Set[Tuple[str, str]], optional): (project, date) to recompute, the date as 
+                "YYYY-MM-DD" or a date. Groups without a date are skipped, only a full 
+                recompute includes them. Defaults to None, recompute everything.
+        """
+        if groups is not None:
+            # str(None) would be "None", which is not a date. Strings and dates of the same day are one group.
+            groups = {(project, str(date)) for project, date in groups if date is not None}
+            if len(groups) == 0:
+                return
+
+        select = """
+            SELECT d.project, d.date, d.run_name, d.datatype, 
+                SUM(d.size)::BIGINT, COUNT(*), MIN(d.start_datetime), MAX(d.end_datetime)
+            FROM data d
+        """
+        group_by = "GROUP BY d.project, d.date, d.run_name, d.datatype"
+
+        if groups is None:
+            cur.execute("LOCK TABLE stats_rollup IN EXCLUSIVE MODE")
+            cur.execute("DELETE FROM stats_rollup")
+            cur.execute(f"INSERT INTO stats_rollup {select} {group_by}")
+            return
+
+        # workers refreshing the same group would both insert it, so they take turns. 
+        # Sorted, so two batches lock their common groups in the same order.
+        groups = sorted(groups, key=str)
+        for project, date in groups:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"stats_rollup:{project}:{date}",))
+        execute_values(cur, """
+            DELETE FROM stats_rollup r USING (VALUES %s) AS g (project, date)
+            WHERE r.project IS NOT DISTINCT FROM g.project AND r.date = g.date::DATE
+        """, groups)
+        execute_values(cur, f"""
+            INSERT INTO stats_rollup {select}
+            JOIN (VALUES %s) AS g (project, date) 
+                ON d.project IS NOT DISTINCT FROM g.project AND d.date = g.date::DATE
+            {group_by}
+        """, groups, page_size=len(groups))
+
+    def _get_generation(self, cur) -> int:
+        cur.execute("SELECT generation FROM data_generation")
+        return cur.fetchone()[0]
+
+    def _bump_generation(self, cur):
+        # part of the transaction that changed the data, so a cached result always matches its generation.
+        cur.execute("UPDATE data_generation SET generation = generation + 1")
+
+    def _upsert_names(self, cur, names:Dict[str, Set[str]], added:Dict[str, Set[str]] = None):
+        """Insert the names not already known, as part of the caller's transaction.
+
+        The cache is not updated here, the transaction may still roll back.
+
+        Args:
+            cur (cursor): Open cursor
+            names (Dict[str, Set[str]]): Maps table name to the names used by a batch
+            added (Dict[str, Set[str]], optional): Filled with the names inserted, for 
+                `_cache_names` once the caller has committed. Defaults to None.
+        """
+        for table, values in names.items():
+            cached = self.m_cache.get(table, {})
+            missing = [(name, "") for name in sorted(values) if name not in cached]
+            if len(missing) == 0:
+                continue
+
+            query = f"INSERT INTO {table} (name, description) VALUES %s ON CONFLICT (name) DO NOTHING"
+            execute_values(cur, query, missing)
+
+            if added is not None:
+                added.setdefault(table, set()).update(name for name, _ in missing)
+
+    def _cache_names(self, added:Dict[str, Set[str]]):
+        # only after the names are committed.
+        for table, values in added.items():
+            cached = self.m_cache.setdefault(table, {})
+            for name in values:
+                cached[name] = cached.get(name, "")
 
     def get_entry(self, upload_id:str) -> dict:
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 query = "SELECT * FROM data WHERE upload_id = %s"
                 cur.execute(query, (upload_id,))
@@ -400,7 +1378,7 @@ class Database:
         return result
 
     def get_all_entries(self) -> List[dict]:
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 query = "SELECT * FROM data"
                 cur.execute(query)
@@ -415,7 +1393,7 @@ class Database:
         self.m_cache[table][name] = description
 
         try:
-            with self.connect() as conn:
+            with self._connection() as conn:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     query = (
                         "INSERT INTO "
@@ -428,7 +1406,7 @@ class Database:
             pass
 
     def _get_names(self, table:str) -> List[str]:
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 query = f"SELECT name FROM {table} ORDER BY name"
                 cur.execute(query)
@@ -441,7 +1419,7 @@ class Database:
         if table in self.m_cache and name in self.m_cache[table]:
             del self.m_cache[table][name]
 
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor() as cur:
                 query = f"DELETE from {table} WHERE name = %s"
                 cur.execute(query, (name,))
@@ -453,16 +1431,15 @@ class Database:
 
         exists = False
         try:
-            conn = self.connect()
-            with conn.cursor() as cur:
-                query = f"SELECT EXISTS(SELECT 1 FROM {table} WHERE name = %s)"
-                cur.execute(query, (name,))
-
-                # Fetch the result (True if exists, False if not)
-                fetch = cur.fetchall()
-                if fetch and len(fetch) > 0:
-                    exists = fetch[0][0]
-            conn.close()
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    query = f"SELECT EXISTS(SELECT 1 FROM {table} WHERE name = %s)"
+                    cur.execute(query, (name,))
+
+                    # Fetch the result (True if exists, False if not)
+                    fetch = cur.fetchall()
+                    if fetch and len(fetch) > 0:
+                        exists = fetch[0][0]
             if exists:
                 self.m_cache[table] = self.m_cache.get(table, {})
                 self.m_cache[table][name] = ""
@@ -477,13 +1454,11 @@ class Database:
         self._add_name(table, name, description)
 
     def _get_names_and_desc(self, table:str) -> List[Tuple[str,str]]:
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 query = f"SELECT * FROM {table} ORDER BY name"
                 cur.execute(query)
                 result = cur.fetchall()  # Fetch all entries as a list of dictionaries
-        cur.close()
-        conn.close()
 
         rtn = [(item["name"], item["description"]) for item in result]
         return rtn
@@ -544,59 +1519,98 @@ class Database:
         self._remove_name("remote_servers", name)
 
     # runs
-    def _set_runs(self):
-        query = """
-        SELECT site, date, robot_name, start_datetime, end_datetime 
-        FROM data 
-        WHERE (datatype = 'mcap' or datatype = 'bag') 
+    def _mark_runs_dirty(self, cur, groups:Set[Tuple[str, str, str]]):
+        """Record (site, date, robot_name) groups whose runs need to be recomputed, as part of the caller's transaction.
+
+        Groups without a date never match the incremental join, only a full recompute includes them.
         """
-        with self.connect() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query)
+        groups = {group for group in groups if group[1] is not None}
+        if len(groups) == 0:
+            return
+        execute_values(cur, "INSERT INTO run_dirty (site, date, robot_name) VALUES %s", sorted(groups, key=str))
 
-                # Execute the query to fetch entries
-                cur.execute(query)
-                results = cur.fetchall()
+    def _set_runs(self, table:str="data", incremental:bool=False):
+        """Name the runs in the data table.
 
-        times = {}
-        for item in results:
-            site = item["site"]
-            date = item["date"].strftime("%Y-%m-%d")
-            robot_name = item["robot_name"]
-            key = (site, date, robot_name)
-            start_time = item["start_datetime"]
-            end_time = item["end_datetime"]
-            times[key] = times.get(key, [])
-            times[key].append((start_time, end_time))
-
-        merged = {}
-        for key in times:
-            sorted_times = sorted(times[key])
-            merged[key] = []
-            for current in sorted_times:
-                if not merged[key] or merged[key][-1][1] < current[0]:
-                    merged[key].append(current)
-                else:
-                    merged[key][-1] = (
-                        merged[key][-1][0],
-                        max(merged[key][-1][1], current[1]),
-                    )
+        Overlapping bag and mcap files of the same site, date and robot form a run. 
+        Runs are numbered by start time within their group as run_001, run_002, ..., 
+        and every file of that group within the time span of a run is given its name.
+        The runs are found with window functions and written in one statement.
 
-        with self.connect() as conn:
+        Args:
+            table (str, optional): "data", or "data_shadow" during a rebuild. Defaults to "data".
+            incremental (bool, optional): Only recompute the groups changed since the 
+                last time runs were set. Defaults to False, recompute every group.
+        """
+        groups_filter = ""
+        if incremental:
+            groups_filter = "JOIN dirty ON d.site IS NOT DISTINCT FROM dirty.site AND d.date = dirty.date AND d.robot_name IS NOT DISTINCT FROM dirty.robot_name"
+
+        query = f"""
+        WITH dirty AS (
+            SELECT DISTINCT site, date, robot_name FROM run_dirty
+        ),
+        files AS (
+            SELECT d.site, d.date, d.robot_name, d.start_datetime, d.end_datetime,
+                MAX(d.end_datetime) OVER (
+                    PARTITION BY d.site, d.date, d.robot_name 
+                    ORDER BY d.start_datetime, d.end_datetime 
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ) AS previous_end
+            FROM {table} d {groups_filter}
+            WHERE d.datatype IN ('mcap', 'bag') AND d.start_datetime IS NOT NULL AND d.end_datetime IS NOT NULL
+        ),
+        numbered AS (
+            SELECT site, date, robot_name, start_datetime, end_datetime,
+                SUM(CASE WHEN previous_end IS NULL OR previous_end < start_datetime THEN 1 ELSE 0 END) OVER (
+                    PARTITION BY site, date, robot_name 
+                    ORDER BY start_datetime, end_datetime 
+                    ROWS UNBOUNDED PRECEDING
+                ) AS idx
+            FROM files
+        ),
+        runs AS (
+            SELECT site, date, robot_name, 
+                'run_' || lpad(idx::text, GREATEST(3, length(idx::text)), '0') AS run_name,
+                MIN(start_datetime) AS start_datetime, MAX(end_datetime) AS end_datetime
+            FROM numbered
+            GROUP BY site, date, robot_name, idx
+        )
+        UPDATE {table} d SET run_name = runs.run_name
+        FROM runs
+        WHERE d.site IS NOT DISTINCT FROM runs.site 
+            AND d.date = runs.date 
+            AND d.robot_name IS NOT DISTINCT FROM runs.robot_name
+            AND d.start_datetime >= runs.start_datetime 
+            AND d.end_datetime <= runs.end_datetime
+            AND d.run_name IS DISTINCT FROM runs.run_name
+        RETURNING d.project, d.date
+        """
+
+        with self._connection() as conn:
             with conn.cursor() as cur:
-                for (site, date, robot_name), runs in merged.items():
-                    for i, (start_time, end_time) in enumerate(runs):
-                        idx = i + 1
-                        run_name = f"run_{idx:03d}"
-                        query = "UPDATE data set run_name = %s WHERE start_datetime >= %s AND end_datetime <= %s"
-                        cur.execute(query, (run_name, start_time, end_time))
-            conn.commit()
+                if table == "data":
+                    # groups marked while this runs wait, rather than being cleared unseen.
+                    cur.execute("LOCK TABLE run_dirty IN SHARE ROW EXCLUSIVE MODE")
+                if incremental:
+                    cur.execute("SELECT EXISTS(SELECT 1 FROM run_dirty)")
+                    if not cur.fetchone()[0]:
+                        return
+                cur.execute(query)
+                renamed = cur.fetchall()
+                debug_print(f"Set runs on {len(renamed)} entries")
+                # a rebuild leaves run_dirty and stats_rollup to the live table.
+                if table == "data":
+                    cur.execute("DELETE FROM run_dirty")
+                    self._refresh_rollup(cur, {(project, date) for project, date in renamed})
+                    if len(renamed) > 0:
+                        self._bump_generation(cur)
 
     # server data
     def get_send_data_ymd_stub(self):
-        with self.connect() as conn:
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                query = f"SELECT DISTINCT project, date FROM data"
+                query = "SELECT DISTINCT project, date FROM stats_rollup"
                 cur.execute(query)
                 results = cur.fetchall()
 
@@ -609,137 +1623,139 @@ class Database:
         return rtn
 
     def get_run_stats(self, send_project=None, send_ymd=None):
-        with self.connect() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if send_project:
-                    if send_ymd:
-                        query = "SELECT * from data where project = %s and date = %s"
-                        cur.execute(query, (send_project, send_ymd))
-                    else:
-                        query = "SELECT * from data where project = %s"
-                        cur.execute(query, (send_project,))
-                else:
-                    query = "SELECT * from data"
-                    cur.execute(query)
-                results = cur.fetchall()
+        """Get the size, count and time span of every run, and of everything together.
 
-        stats = {
-            "total": {
-                "total_size": 0,
-                "count": 0,
-                "start_datetime": None,
-                "end_datetime": None,
-                "datatype": {}
-            }
-        }
-        for entry in results:
-            project = entry.get("project")
-            ymd = entry.get("date").strftime("%Y-%m-%d")
-            run = entry["run_name"]
+        The totals are read from stats_rollup, one row per run and datatype, 
+        so the cost grows with the number of runs rather than files.
+
+        Args:
+            send_project (str, optional): Only this project. Defaults to None, all projects.
+            send_ymd (str, optional): Only this date of the project. Defaults to None, all dates.
+
+        Returns:
+            dict: "total" and [project][ymd][run], each a stat as described in `_set_stat`
+        """
+        conditions = []
+        params = []
+        if send_project:
+            conditions.append("project = %s")
+            params.append(send_project)
+            if send_ymd:
+                conditions.append("date = %s")
+                params.append(send_ymd)
+        where = ""
+        if len(conditions) > 0:
+            where = "WHERE " + " AND ".join(conditions)
+
+        # GROUPING is a bit mask of the columns left out of a row's grouping set. 
+        # 0: run and datatype, 1: run, 14: datatype, 15: everything
+        query = f"""
+            SELECT project, date, run_name, datatype,
+                GROUPING(project, date, run_name, datatype) AS grouping,
+                SUM(total_size)::BIGINT AS total_size, 
+                COALESCE(SUM(count), 0)::BIGINT AS count,
+                MIN(start_datetime) AS start_datetime, 
+                MAX(end_datetime) AS end_datetime
+            FROM stats_rollup {where}
+            GROUP BY GROUPING SETS ((project, date, run_name, datatype), (project, date, run_name), (datatype), ())
+        """
 
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params)
+                results = cur.fetchall()
 
+        stats = {"total": self._empty_stat()}
+        for row in results:
+            if row["count"] == 0:
+                continue
+
+            grouping = row["grouping"]
+            if grouping == 15:
+                self._set_stat(stats["total"], row)
+                continue
+            if grouping == 14:
+                self._set_datatype_stat(stats["total"], row)
+                continue
+
+            project = row["project"]
+            ymd = row["date"].strftime("%Y-%m-%d")
+            run = row["run_name"]
             stats[project] = stats.get(project, {})
             stats[project][ymd] = stats[project].get(ymd, {})
-            stats[project][ymd][run] = stats[project][ymd].get(
-                run,
-                {
-                    "total_size": 0,
-                    "count": 0,
-                    "start_datetime": None,
-                    "end_datetime": None,
-                    "datatype": {},
-                },
-            )
+            stats[project][ymd][run] = stats[project][ymd].get(run, self._empty_stat())
 
-            self._update_stats_for_entry(entry, stats[project][ymd][run])
-            self._update_stats_for_entry(entry, stats["total"])
+            if grouping == 1:
+                self._set_stat(stats[project][ymd][run], row)
+            else:
+                self._set_datatype_stat(stats[project][ymd][run], row)
 
         return stats
 
-    def _update_stats_for_entry(self, entry:dict, stat:dict):
+    def _empty_stat(self) -> dict:
+        return {
+            "total_size": 0,
+            "count": 0,
+            "start_datetime": None,
+            "end_datetime": None,
+            "datatype": {},
+        }
+
+    def _set_stat(self, stat:dict, row:dict):
         """
-        Updates cumulative statistics for a data entry, including total size, count, 
-        date range, and breakdown by datatype.
+        Fills in a stat from an aggregated row.
 
         Args:
-            entry (dict): A dictionary representing a data entry with keys:
-                - "size" (int): Size of the entry in bytes.
-                - "start_datetime" (datetime, optional): Start timestamp.
-                - "end_datetime" (datetime, optional): End timestamp.
-                - "datatype" (str): The data type of the entry.
-            stat (dict): The cumulative statistics dictionary to update, including:
+            stat (dict): The statistics dictionary to fill, including:
                 - "total_size" (int): Total size of entries.
                 - "htotal_size" (str): Human-readable format of total size.
-                - "count" (int): Number of entries processed.
+                - "count" (int): Number of entries.
                 - "start_datetime" (str): Earliest start time.
                 - "end_datetime" (str): Latest end time.
                 - "duration" (int): Duration in seconds between the earliest start 
                 and latest end times.
                 - "hduration" (str): Human-readable format of the duration.
-                - "datatype" (dict): Breakdown by datatype, with each datatype 
-                containing its own total size and count.
-
-        Updates:
-            - Updates `stat` to include the new `entry` data, adjusting cumulative
-            size, count, start/end times, and duration, formatted for readability.
-
-        Raises:
-            AssertionError: If duration calculation results in a non-timedelta value.
+                - "datatype" (dict): Breakdown by datatype, filled by `_set_datatype_stat`
+            row (dict): Row with "total_size", "count", "start_datetime" and "end_datetime"
         """
-        size = entry["size"]
-        start_time = entry.get("start_datetime")
-        end_time = entry.get("end_datetime")
-        datatype = entry["datatype"]
-
-        if start_time:
-            start_time = start_time.strftime("%Y-%m-%d %H:%M:%S")
-        if end_time:
-            end_time = end_time.strftime("%Y-%m-%d %H:%M:%S")
-
-        stat["total_size"] += size
-        stat["htotal_size"] = humanfriendly.format_size(stat["total_size"])
-        stat["count"] += 1
-
-        if stat["start_datetime"]:
-            stat["start_datetime"] = min(start_time, stat["start_datetime"])
-        else:
-            stat["start_datetime"] = start_time
-
-        if stat["end_datetime"]:
-            stat["end_datetime"] = max(end_time, stat["end_datetime"])
-        else:
-            stat["end_datetime"] = end_time
-
-        duration = datetime.strptime(
-                stat["end_datetime"], "%Y-%m-%d %H:%M:%S"
-            ) - datetime.strptime(stat["start_datetime"], "%Y-%m-%d %H:%M:%S")
-
-        assert isinstance(duration, timedelta)
+        start_time = row["start_datetime"]
+        end_time = row["end_datetime"]
+
+        stat["total_size"] = row["total_size"]
+        stat["htotal_size"] = humanfriendly.format_size(row["total_size"])
+        stat["count"] = row["count"]
+        stat["start_datetime"] = start_time.strftime("%Y-%m-%d %H:%M:%S") if start_time else None
+        stat["end_datetime"] = end_time.strftime("%Y-%m-%d %H:%M:%S") if end_time else None
+
+        duration = timedelta(0)
+        if start_time and end_time:
+            duration = end_time - start_time
         stat["duration"] = duration.seconds
         stat["hduration"] = humanfriendly.format_timespan(duration.seconds)
 
-        stat["datatype"][datatype] = stat["datatype"].get(
-                datatype, {"total_size": 0, "count": 0}
-            )
-        stat["datatype"][datatype]["total_size"] += size
-        stat["datatype"][datatype]["htotal_size"] = humanfriendly.format_size(
-                stat["datatype"][datatype]["total_size"]
-            )
-
-        stat["datatype"][datatype]["count"] += 1
+    def _set_datatype_stat(self, stat:dict, row:dict):
+        stat["datatype"][row["datatype"]] = {
+            "total_size": row["total_size"],
+            "htotal_size": humanfriendly.format_size(row["total_size"]),
+            "count": row["count"],
+        }
 
-    def get_send_data_ymd(self, send_project:str=None, send_ymd:str=None):
+    def get_send_data_ymd(self, send_project:str=None, send_ymd:str=None) -> Iterator:
         """
-        Retrieves and structures data entries from the database by project and date, 
-        grouping them in batches and including relevant metadata.
+        Streams data entries from the database by project and date, grouped in 
+        batches and including relevant metadata.
+
+        Rows are read through a server side cursor, so only one block is held in 
+        memory and the first block is ready as soon as its rows are read.
 
         Args:
             send_project (str, optional): Project name to filter data by. If None, data for all projects is fetched.
             send_ymd (str, optional): Specific date (in "YYYY-MM-DD" format) to filter data by. Ignored if None.
 
-        Returns:
-            list: A list of dictionaries, where each dictionary contains up to 500 entries with metadata fields,
-                grouped by `run_name` and `relpath`. Each entry includes:
+        Yields:
+            int: First, the number of blocks that follow. Counted in the same snapshot as the blocks.
+            dict: Then each block of up to 500 entries with metadata fields,
+                grouped by `run_name` and `relpath`. The last block may be empty. Each entry includes:
                 - "basename" (str): Base file name.
                 - "datatype" (str): Data type (e.g., file type).
                 - "datetime" (str): Timestamp for the entry.
@@ -764,87 +1780,101 @@ class Database:
             - Formats date-related fields for consistency.
             - Groups data by `run_name` and `relpath`.
         """
-        rtnarr = []
         rtn = {}
         max_count = 500
         count = 0
 
-        with self.connect() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if send_project:
-                    if send_ymd:
-                        query = "SELECT * from data where project = %s and date = %s"
-                        cur.execute(query, (send_project, send_ymd))
-                    else:
-                        query = "SELECT * from data where project = %s"
-                        cur.execute(query, (send_project,))
-                else:
-                    query = "SELECT * from data"
-                    cur.execute(query)
-                results = cur.fetchall()
+        where = ""
+        params = []
+        if send_project:
+            where = "WHERE project = %s"
+            params.append(send_project)
+            if send_ymd:
+                where += " AND date = %s"
+                params.append(send_ymd)
 
-        for entry in results:
-            robot = entry["robot_name"]
-            run = entry["run_name"]
-            basename = entry["basename"]
-            relpath = entry["relpath"]
-            size = entry["size"]
-            site = entry["site"]
-            topics = entry.get("topics", [])
-            upload_id = entry["upload_id"]
-            localpath = entry["localpath"]
-            fullpath = entry.get("fullpath", "")
-            datatype = entry["datatype"]
-            date = entry["datetime"].strftime("%Y-%m-%d %H:%M:%S")
-            ymd = entry["date"].strftime("%Y-%m-%d")
-
-            if site is None:
-                site = "default"
-            complete_relpath = os.path.join(ymd, site, robot, relpath, basename)
-
-            rtn[run] = rtn.get(run, {})
-            rtn[run][relpath] = rtn[run].get(relpath, [])
-            rtn[run][relpath].append(
-                {
-                    "basename": basename,
-                    "datatype": datatype,
-                    "datetime": date,
-                    "end_datetime": entry["end_datetime"].strftime("%Y-%m-%d %H:%M:%S"),
-                    "fullpath": fullpath,
-                    "complete_relpath": complete_relpath,
-                    "hsize": humanfriendly.format_size(size),
-                    "localpath": localpath,
-                    "on_local": True,
-                    "on_remote": False,
-                    "relpath": relpath,
-                    "robot_name": robot,
-                    "run_name": run,
-                    "site": site,
-                    "size": size,
-                    "start_datetime": entry["start_datetime"].strftime(
-                        "%Y-%m-%d %H:%M:%S"
-                    ),
-                    "topics": topics,
-                    "upload_id": upload_id,
-                }
-            )
-            count += 1
-            if count >= max_count:
-                rtnarr.append(rtn)
-                rtn = {}
-                count = 0
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                # the count and the rows must agree, the ui waits for every block.
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cur.execute(f"SELECT COUNT(*) FROM data {where}", params)
+                yield cur.fetchone()[0] // max_count + 1
+
+            with conn.cursor(name="send_data_ymd", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = 2000
+                cur.execute(f"SELECT * FROM data {where}", params)
+
+                for entry in cur:
+                    robot = entry["robot_name"]
+                    run = entry["run_name"]
+                    basename = entry["basename"]
+                    relpath = entry["relpath"]
+                    size = entry["size"]
+                    site = entry["site"]
+                    topics = entry.get("topics", [])
+                    upload_id = entry["upload_id"]
+                    localpath = entry["localpath"]
+                    fullpath = entry.get("fullpath", "")
+                    datatype = entry["datatype"]
+                    date = entry["datetime"].strftime("%Y-%m-%d %H:%M:%S")
+                    ymd = entry["date"].strftime("%Y-%m-%d")
+
+                    if site is None:
+                        site = "default"
+                    complete_relpath = os.path.join(ymd, site, robot, relpath, basename)
+
+                    rtn[run] = rtn.get(run, {})
+                    rtn[run][relpath] = rtn[run].get(relpath, [])
+                    rtn[run][relpath].append(
+                        {
+                            "basename": basename,
+                            "datatype": datatype,
+                            "datetime": date,
+                            "end_datetime": entry["end_datetime"].strftime("%Y-%m-%d %H:%M:%S"),
+                            "fullpath": fullpath,
+                            "complete_relpath": complete_relpath,
+                            "hsize": humanfriendly.format_size(size),
+                            "localpath": localpath,
+                            "on_local": True,
+                            "on_remote": False,
+                            "relpath": relpath,
+                            "robot_name": robot,
+                            "run_name": run,
+                            "site": site,
+                            "size": size,
+                            "start_datetime": entry["start_datetime"].strftime(
+                                "%Y-%m-%d %H:%M:%S"
+                            ),
+                            "topics": topics,
+                            "upload_id": upload_id,
+                        }
+                    )
+                    count += 1
+                    if count >= max_count:
+                        yield rtn
+                        rtn = {}
+                        count = 0
 
-        rtnarr.append(rtn)
-        return rtnarr
+        yield rtn
 
     # node data format:
-    def get_node_data_blocks(self):
-        blocks = []
+    def get_node_data_blocks(self) -> Iterator:
+        """Streams every entry, in blocks of 100, through a server side cursor.
 
+        Yields:
+            int: First, the number of blocks that follow. Counted in the same snapshot as the blocks.
+            List[dict]: Then each block of entries, with the time fields formatted.
+        """
         block_size = 100
         block = []
-        with self.connect() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cur.execute("SELECT COUNT(*) FROM data")
+                yield math.ceil(cur.fetchone()[0] / block_size)
+
+            with conn.cursor(name="node_data_blocks", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = 2000
                 query = "SELECT * FROM data"
                 cur.execute(query)
 
@@ -855,11 +1885,10 @@ class Database:
 
                     block.append(entry)
                     if len(block) >= block_size:
-                        blocks.append(block)
+                        yield block
                         block = []
         if len(block) > 0:
-            blocks.append(block)
-        return blocks
+            yield block
 
     # search
     def get_search_filters(self):
@@ -867,12 +1896,16 @@ class Database:
         Generates a set of filter options for search functionality based on 
         entries in the `data` table, categorizing columns as discrete or range types.
 
+        Values are collected by the database from indexed columns, and the result 
+        is cached in Redis for the current data generation, so it is shared by 
+        every worker and only recomputed after entries are added or removed.
+
         Returns:
             dict: A dictionary of filter options for each key, structured as:
                 - For discrete keys (e.g., "project", "site"):
                     {
                         "type": "discrete",
-                        "keys": list of unique values for the key
+                        "keys": sorted list of unique values for the key, "None" for empty values
                     }
                 - For range keys (e.g., "datetime", "size"):
                     {
@@ -880,106 +1913,311 @@ class Database:
                         "min": minimum value for the key,
                         "max": maximum value for the key
                     }
+                - "text": {"type": "text"}, a part of a file name or path
+                - "overlap": {"type": "overlap", "min", "max"}, the span of recording times
+                Empty when there are no entries. A range key, or "overlap", is left out 
+                when every entry has it empty.
+        """
+        discrete_keys = ["project", "site", "robot_name", "datatype"]
+        range_keys = ["datetime", "size", "duration"]
+        filters = {}
+
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                generation = self._get_generation(cur)
+                key = f"search_filters:{generation}"
+                cached = self.redis.get(key)
+                if cached is not None:
+                    return json.loads(cached)
+
+                cur.execute("SELECT EXISTS(SELECT 1 FROM data)")
+                if not cur.fetchone()[0]:
+                    return filters
+
+                for name in discrete_keys:
+                    filters[name] = {"type": "discrete", "keys": self._distinct_values(cur, name)}
+
+                filters["topics"] = {"type": "discrete", "keys": self._distinct_values(cur, "topic", table="entry_topics")}
+                filters["text"] = {"type": "text"}
+
+                # from the rollup, start and end times are not indexed on data.
+                cur.execute("SELECT MIN(start_datetime), MAX(end_datetime) FROM stats_rollup")
+                min_val, max_val = cur.fetchone()
+                if min_val and max_val:
+                    filters["overlap"] = {
+                        "type": "overlap", 
+                        "min": min_val.strftime("%Y-%m-%d %H:%M:%S"), 
+                        "max": max_val.strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+
+                for name in range_keys:
+                    cur.execute(f"SELECT MIN({name}), MAX({name}) FROM data")
+                    min_val, max_val = cur.fetchone()
+                    if min_val is None or max_val is None:
+                        # every entry has it empty, nothing to filter on, as with no entries.
+                        continue
+                    filters[name] = {"type": "range", "min": min_val, "max": max_val}
+
+        if "datetime" in filters:
+            filters["datetime"]["min"] = filters["datetime"]["min"].strftime("%Y-%m-%d %H:%M:%S")
+            filters["datetime"]["max"] = filters["datetime"]["max"].strftime("%Y-%m-%d %H:%M:%S")
+
+        self.redis.set(key, json.dumps(filters), ex=3600)
+        return filters
+
+    def _distinct_values(self, cur, column:str, table:str="data") -> List[str]:
+        """The distinct values of an indexed column.
+
+        Walks the index one value at a time (a loose index scan), so the 
+        cost grows with the number of values rather than rows.
+        """
+        query = f"""
+            WITH RECURSIVE t AS (
+                (SELECT {column} AS value FROM {table} WHERE {column} IS NOT NULL ORDER BY {column} LIMIT 1)
+                UNION ALL
+                SELECT (SELECT {column} FROM {table} WHERE {column} > t.value ORDER BY {column} LIMIT 1) 
+                FROM t WHERE t.value IS NOT NULL
+            )
+            SELECT value FROM t WHERE value IS NOT NULL
+        """
+        cur.execute(query)
+        values = [row[0] for row in cur.fetchall()]
+
+        cur.execute(f"SELECT EXISTS(SELECT 1 FROM {table} WHERE {column} IS NULL OR {column} = '')")
+        has_empty = cur.fetchone()[0]
+
+        keys = [value for value in values if value]
+        if has_empty:
+            keys.append("None")
+        return keys
+
+    def export_search(self, filters: dict, order_by: str = "datetime", reverse: bool = False, cursor: str = None) -> Iterator[dict]:
+        """Stream every entry that matches the filters, through a server side cursor.
+
+        Memory stays constant however many rows match. Each entry carries the
+        cursor of its position, pass the last one received to resume after it.
+
+        Args:
+            filters (dict): A dictionary specifying search filters, as for `search`.
+            order_by (str, optional): Sort key, one of SEARCH_SORT_KEYS. Defaults to "datetime".
+            reverse (bool, optional): Whether to sort in descending order. Defaults to False.
+            cursor (str, optional): Resume after this entry. Defaults to None, from the start.
+
+        Yields:
+            dict: An entry with formatted size (`hsize`) and datetime fields, and "cursor".
+        """
+        if order_by not in SEARCH_SORT_KEYS:
+            order_by = "datetime"
+        after = None
+        if cursor:
+            after = decode_search_cursor(cursor, order_by, reverse)
+            if after is None:
+                raise ValueError("Invalid cursor for this sort")
+
+        query, params = build_paginated_query(filters, order_by, None, reverse, after)
+
+        with self._connection() as conn:
+            with conn.cursor(name="export_search", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = 2000
+                cur.execute(query, params)
+
+                for entry in cur:
+                    entry["cursor"] = encode_search_cursor(order_by, reverse, entry.pop("sort_value"), entry["upload_id"])
+                    entry["hsize"] = humanfriendly.format_size(entry["size"])
+                    for key, format in self.m_time_format.items():
+                        if entry.get(key) is not None:
+                            entry[key] = entry[key].strftime(format)
+                    yield entry
+
+    def find_overlapping(self, start: str, end: str, filters: dict = None, limit: int = 1000) -> Tuple[List[dict], bool]:
+        """Find the entries recorded at any time between start and end.
+
+        Answers "what else was recorded at the same time", across robots, with 
+        the data_time_range_idx index.
+
+        Args:
+            start (str): "YYYY-MM-DD HH:MM:SS"
+            end (str): "YYYY-MM-DD HH:MM:SS"
+            filters (dict, optional): Other search filters, such as site. Defaults to None.
+            limit (int, optional): Most entries returned. Defaults to 1000.
+
+        Returns:
+            Tuple[List[dict], bool]: The entries ordered by robot and start time, with formatted
+                size (`hsize`) and datetime fields, and True if there were more than `limit`.
 
         Notes:
-            - The `discrete_keys` list contains columns categorized as discrete filters.
-            - The `range_keys` list contains columns categorized as range filters.
-            - `datetime` values are formatted as strings for consistency.
-            - Filters are constructed from database values, with lists and dictionaries
-            expanded to unique values in `discrete` filters.
+            - start and end can be given in either order. Entries with no times are never returned.
+
+        Raises:
+            ValueError: start or end is not a time.
         """
+        # checked here, build_search_conditions would drop a bad range and match everything.
+        parse_search_timestamp(start)
+        parse_search_timestamp(end)
 
-        discrete_keys = ["project", "site", "robot_name", "topics", "datatype"]
-        range_keys = ["datetime", "size", "duration"]
-        filters = {}
+        filters = dict(filters or {})
+        filters["overlap"] = {"type": "overlap", "start": start, "end": end}
+        conditions, params = build_search_conditions(filters)
 
-        with self.connect() as conn:
+        query = f"""
+            SELECT * FROM data WHERE {" AND ".join(conditions)}
+            ORDER BY robot_name, start_datetime, upload_id LIMIT %s
+        """
+        params.append(int(limit) + 1)
+
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                query = "SELECT * FROM data"
-                cur.execute(query)
+                self._execute_prepared(cur, query, params)
+                entries = cur.fetchall()
 
-                for entry in cur:
-                    duration = entry["end_datetime"] - entry["start_datetime"]
-                    entry["duration"] = duration.seconds
-
-                    for key in discrete_keys:
-                        filters[key] = filters.get(
-                            key, {"type": "discrete", "keys": set()}
-                        )
-
-                        if isinstance(entry[key], list):
-                            for item in entry[key]:
-                                if entry[key]:
-                                    filters[key]["keys"].add(item)
-                                else:
-                                    filters[key]["keys"].add("None")
-
-                        elif isinstance(entry[key], dict):
-                            for item in sorted(entry[key]):
-                                if item:
-                                    filters[key]["keys"].add(item)
-                                else:
-                                    filters[key]["keys"].add("None")
-                        else:
-                            if entry[key]:
-                                filters[key]["keys"].add(entry[key])
-                            else:
-                                filters[key]["keys"].add("None")
-
-                    for key in range_keys:
-                        filters[key] = filters.get(
-                            key, {"type": "range", "min": entry[key], "max": entry[key]}
-                        )
-                        filters[key]["min"] = min(filters[key]["min"], entry[key])
-                        filters[key]["max"] = max(filters[key]["max"], entry[key])
-
-        for key in filters:
-            if key == "datetime":
-                filters[key]["min"] = filters[key]["min"].strftime("%Y-%m-%d %H:%M:%S")
-                filters[key]["max"] = filters[key]["max"].strftime("%Y-%m-%d %H:%M:%S")
-            elif filters[key]["type"] == "discrete":
-                filters[key]["keys"] = list(filters[key]["keys"])
+        truncated = len(entries) > limit
+        entries = entries[:limit]
+        for entry in entries:
+            entry["hsize"] = humanfriendly.format_size(entry["size"])
+            for key, format in self.m_time_format.items():
+                if key in entry:
+                    entry[key] = entry[key].strftime(format)
+        return entries, truncated
 
-        return filters
+    @contextmanager
+    def _search_connection(self, search: Tuple[str, int] = None, repeatable_read: bool = False):
+        """Borrow a connection for a search query, with the search deadline set.
+
+        While the block runs, the connection is registered under the search key, 
+        so `cancel_search` can stop its query when a newer search supersedes it.
+
+        Args:
+            search (Tuple[str, int], optional): (key, seq) of the search, usually the room 
+                and its search sequence number. Defaults to None, not cancellable.
+            repeatable_read (bool, optional): Run the transaction at REPEATABLE READ. Defaults to False.
+
+        Yields:
+            connection: a psycopg2 connection
+
+        Raises:
+            psycopg2.extensions.QueryCanceledError: the deadline passed, or the search was cancelled.
+        """
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                if repeatable_read:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                # local to the transaction, so the pooled connection goes back without it.
+                cur.execute("SET LOCAL statement_timeout = %s", (self.m_search_timeout_ms,))
+
+            if search is None:
+                yield conn
+                return
+
+            key, seq = search
+            with self.m_searches_lock:
+                self.m_searches[key] = (seq, conn)
+            try:
+                yield conn
+            finally:
+                # under the lock, so a cancel is never sent once the connection has moved on.
+                with self.m_searches_lock:
+                    if self.m_searches.get(key, (None, None))[1] is conn:
+                        del self.m_searches[key]
+
+    def cancel_search(self, key: str, seq: int) -> bool:
+        """Cancel the query running for a search that is older than `seq`.
+
+        Args:
+            key (str): Search key, usually the room.
+            seq (int): Sequence number of the newest search for the key.
+
+        Returns:
+            bool: True if a query was cancelled.
+        """
+        with self.m_searches_lock:
+            running = self.m_searches.get(key)
+            if running is None or running[0] is None or running[0] >= seq:
+                return False
+            # sends a cancel request to the backend, the same as pg_cancel_backend.
+            running[1].cancel()
+            return True
 
     def search(
-        self, filters: dict, order_by: str, offset: int, page_size: int, reverse: bool
-    ):
-        
+        self, filters: dict, order_by: str, page_size: int, reverse: bool, cursor: str = None, direction: str = "first",
+        facets: bool = False, search: Tuple[str, int] = None
+    ) -> Tuple[List[dict], int, str, str, dict]:
         """
-        Executes a paginated search query based on provided filters, ordering, 
-        and pagination settings, and returns the results along with the total count.
+        Executes a keyset paginated search query based on provided filters, ordering, 
+        and position, and returns the results along with the total count.
+
+        Every page costs the same, however deep. Pages are found by seeking to the 
+        row in the cursor rather than skipping over the rows before it.
 
         Args:
             filters (dict): A dictionary specifying search filters for the query.
-            order_by (str): Column name to sort the results by.
-            offset (int): Number of rows to skip before starting to collect the result set.
+            order_by (str): Sort key, one of SEARCH_SORT_KEYS. Others sort by "datetime".
             page_size (int): Maximum number of entries to retrieve.
             reverse (bool): Whether to sort the results in descending order.
+            cursor (str, optional): A cursor returned by an earlier search with the same sort. Defaults to None.
+            direction (str, optional): "first", "last", "next" (after the cursor) or "prev" (before it). Defaults to "first".
+            facets (bool, optional): Also count the matches per value of each column in SEARCH_FACET_COLUMNS. Defaults to False.
+            search (Tuple[str, int], optional): (key, seq) that lets `cancel_search` stop this search. Defaults to None.
 
         Returns:
             tuple: 
                 - List[dict]: Each dictionary represents an entry with formatted 
                 size (`hsize`) and datetime fields.
                 - int: Total count of entries that match the filters without pagination.
+                - str: cursor for the page before these results, None on the first page.
+                - str: cursor for the page after these results, None on the last page.
+                - dict: {column: {value: count}} when `facets` is set, otherwise None. 
+                Empty values are counted as "None".
         Notes:
             - Formats size and datetime fields in each entry before returning.
+            - An invalid cursor, or one from a different sort, starts from the first page.
+            - Every query is limited to SEARCH_TIMEOUT_MS, and raises QueryCanceledError when it runs over 
+            or the search is cancelled.
         """
-        search_query = build_paginated_query(
-            filters, order_by, offset, page_size, reverse
-        )
-        count_query = build_count_query(filters)
+        page_size = int(page_size)
+        if order_by not in SEARCH_SORT_KEYS:
+            order_by = "datetime"
+        facet_counts = None
+        if facets:
+            total, facet_counts = self._search_facets(filters, search)
+        else:
+            total = self._search_count(filters, search)
 
-        rtn = []
-        with self.connect() as conn:
+        after = None
+        if cursor and direction in ("next", "prev"):
+            after = decode_search_cursor(cursor, order_by, reverse)
+        if after is None and direction in ("next", "prev"):
+            direction = "first"
+
+        backward = direction in ("prev", "last")
+        limit = page_size
+        if direction == "last":
+            # the last page holds what is left after the full pages.
+            limit = total - (max(0, math.ceil(total / page_size) - 1) * page_size)
+
+        search_query, params = build_paginated_query(filters, order_by, limit, reverse, after, backward)
+
+        with self._search_connection(search) as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(search_query)
+                self._execute_prepared(cur, search_query, params)
                 entries = cur.fetchall()
 
-                cur.execute(count_query)
-                count = cur.fetchall()[0]["count"]
+        if backward:
+            entries.reverse()
+
+        prev_cursor = None
+        next_cursor = None
+        if len(entries) > 0:
+            first = entries[0]
+            last = entries[-1]
+            if direction != "first":
+                prev_cursor = encode_search_cursor(order_by, reverse, first["sort_value"], first["upload_id"])
+            if direction != "last":
+                next_cursor = encode_search_cursor(order_by, reverse, last["sort_value"], last["upload_id"])
 
+        rtn = []
         for entry in entries:
+            del entry["sort_value"]
             entry["hsize"] = humanfriendly.format_size(entry["size"])
 
             for key, format in self.m_time_format.items():
@@ -987,4 +2225,70 @@ class Database:
                     entry[key] = entry[key].strftime(format)
 
             rtn.append(entry)
-        return rtn, count
+        return rtn, total, prev_cursor, next_cursor, facet_counts
+
+    def _search_count(self, filters: dict, search: Tuple[str, int] = None) -> int:
+        """Count the entries that match the filters.
+
+        Counts are cached in Redis by filter and data generation, so paging through 
+        results counts once, and any change to the data table makes a new count.
+        """
+        digest = hashlib.sha1(normalize_search_filters(filters).encode("utf-8")).hexdigest()
+        count_query, params = build_count_query(filters)
+
+        with self._search_connection(search, repeatable_read=True) as conn:
+            with conn.cursor() as cur:
+                # the generation and the count are read from the same snapshot.
+                generation = self._get_generation(cur)
+
+                key = f"search_count:{generation}:{digest}"
+                cached = self.redis.get(key)
+                if cached is not None:
+                    return int(cached)
+
+                self._execute_prepared(cur, count_query, params)
+                count = cur.fetchone()[0]
+
+        self.redis.set(key, count, ex=3600)
+        return count
+
+    def _search_facets(self, filters: dict, search: Tuple[str, int] = None) -> Tuple[int, dict]:
+        """Count the entries that match the filters, in total and per value of each facet column.
+
+        One grouped query gives both, and they are cached like `_search_count`.
+
+        Returns:
+            Tuple[int, dict]: the total, and {column: {value: count}}
+        """
+        digest = hashlib.sha1(normalize_search_filters(filters).encode("utf-8")).hexdigest()
+        facet_query, params = build_facet_query(filters)
+
+        with self._search_connection(search, repeatable_read=True) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                generation = self._get_generation(cur)
+
+                key = f"search_facets:{generation}:{digest}"
+                cached = self.redis.get(key)
+                if cached is not None:
+                    cached = json.loads(cached)
+                    return cached["total"], cached["facets"]
+
+                self._execute_prepared(cur, facet_query, params)
+                rows = cur.fetchall()
+
+        total = 0
+        facets = {column: {} for column in SEARCH_FACET_COLUMNS}
+        everything = (1 << len(SEARCH_FACET_COLUMNS)) - 1
+        for row in rows:
+            if row["grouping"] == everything:
+                total = row["count"]
+                continue
+            for i, column in enumerate(SEARCH_FACET_COLUMNS):
+                # the column grouped by this row has its bit clear, leftmost column is the highest bit.
+                if not row["grouping"] & (1 << (len(SEARCH_FACET_COLUMNS) - 1 - i)):
+                    value = row[column] or "None"
+                    facets[column][value] = facets[column].get(value, 0) + row["count"]
+
+        self.redis.set(key, json.dumps({"total": total, "facets": facets}), ex=3600)
+        self.redis.set(f"search_count:{generation}:{digest}", total, ex=3600)
+        return total, facets
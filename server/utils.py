@@ -165,6 +165,393 @@ def get_upload_id(source: str, project: str, file: str) -> str:
     return hash_object.hexdigest()
 
 
+# Stores one remote entry, or deletes it when ARGV[3] is empty, and keeps its 
+# indexes and stats counters in step, in one atomic call. The old version of the 
+# entry is taken out of the counters before the new one goes in, so storing the 
+# same entry again does not count it twice.
+#
+# KEYS[1]: remote_entries:{source}
+# KEYS[2]: remote_entries_index:{source}
+# KEYS[3]: remote_entries_ttl:{source}, set by expire_remote_entries while the source 
+#          is disconnected. Its TTL is the time its entries have left, and every key 
+#          written here gets it too. Without it, or without a TTL, keys are kept.
+# ARGV[1]: source
+# ARGV[2]: upload id
+# ARGV[3]: entry json, or "" to delete
+_STORE_REMOTE_ENTRY_LUA = """
+local source = ARGV[1]
+local upload_id = ARGV[2]
+-- keys written, they follow the expiry of a disconnected source.
+local touched = {KEYS[1], KEYS[2]}
+
+local function field(entry, name)
+    local value = entry[name]
+    if value == cjson.null or value == "" then
+        return nil
+    end
+    return value
+end
+
+local function apply(entry, sign)
+    local size = tonumber(field(entry, "size")) or 0
+    local on_server = 0
+    if field(entry, "on_server") then
+        on_server = 1
+    end
+    local datatype = tostring(field(entry, "datatype") or "")
+    local manifest_hash = field(entry, "manifest_hash")
+    local start_datetime = field(entry, "start_datetime")
+    local end_datetime = field(entry, "end_datetime")
+    local date = field(entry, "date")
+    if not date and field(entry, "datetime") then
+        date = string.sub(field(entry, "datetime"), 1, 10)
+    end
+
+    local stats = {"remote_stats:" .. source}
+    if date then
+        local project = tostring(field(entry, "project") or "None")
+        local date_key = "remote_entries_date:" .. source .. ":" .. date
+        local project_date_key = "remote_entries_project_date:" .. source .. ":" .. project .. ":" .. date
+        local date_stats = "remote_stats:" .. source .. ":" .. date
+        if sign > 0 then
+            redis.call("SADD", date_key, upload_id)
+            redis.call("SADD", project_date_key, upload_id)
+            redis.call("SADD", KEYS[2], date_key, project_date_key, date_stats)
+        else
+            redis.call("SREM", date_key, upload_id)
+            redis.call("SREM", project_date_key, upload_id)
+        end
+        table.insert(stats, date_stats)
+        table.insert(touched, date_key)
+        table.insert(touched, project_date_key)
+    end
+
+    for _, key in ipairs(stats) do
+        table.insert(touched, key)
+        if redis.call("HINCRBY", key, "count", sign) <= 0 then
+            -- nothing left, the time range goes with it.
+            redis.call("DEL", key)
+        else
+            local prefix = "datatype:" .. datatype .. ":"
+            redis.call("HINCRBY", key, "total_size", string.format("%d", sign * size))
+            redis.call("HINCRBY", key, "on_server_size", string.format("%d", sign * size * on_server))
+            redis.call("HINCRBY", key, "on_server_count", sign * on_server)
+            redis.call("HINCRBY", key, prefix .. "count", sign)
+            redis.call("HINCRBY", key, prefix .. "total_size", string.format("%d", sign * size))
+            redis.call("HINCRBY", key, prefix .. "on_server_size", string.format("%d", sign * size * on_server))
+            redis.call("HINCRBY", key, prefix .. "on_server_count", sign * on_server)
+            -- sums of the manifest hashes, in 28 bit parts, see manifest_digest.
+            if manifest_hash then
+                redis.call("HINCRBY", key, "manifest:count", sign)
+                for part = 1, 4 do
+                    local value = tonumber(string.sub(manifest_hash, part * 7 - 6, part * 7), 16)
+                    redis.call("HINCRBY", key, "manifest:" .. part, sign * value)
+                end
+            end
+            -- times are "YYYY-MM-DD HH:MM:SS", they compare as strings. 
+            -- a removed entry does not shrink the range.
+            if sign > 0 and start_datetime then
+                local current = redis.call("HGET", key, "start_datetime")
+                if not current or start_datetime < current then
+                    redis.call("HSET", key, "start_datetime", start_datetime)
+                end
+            end
+            if sign > 0 and end_datetime then
+                local current = redis.call("HGET", key, "end_datetime")
+                if not current or end_datetime > current then
+                    redis.call("HSET", key, "end_datetime", end_datetime)
+                end
+            end
+        end
+    end
+end
+
+local old = redis.call("HGET", KEYS[1], upload_id)
+if old then
+    apply(cjson.decode(old), -1)
+end
+if ARGV[3] == "" then
+    redis.call("HDEL", KEYS[1], upload_id)
+else
+    redis.call("HSET", KEYS[1], upload_id, ARGV[3])
+    apply(cjson.decode(ARGV[3]), 1)
+end
+
+-- set by expire_remote_entries while the source is disconnected.
+local ttl = redis.call("PTTL", KEYS[3])
+if ttl > 0 then
+    for _, key in ipairs(touched) do
+        redis.call("PEXPIRE", key, ttl)
+    end
+end
+return 0
+"""
+
+
+def store_remote_entries(r: redis.StrictRedis, source: str, entries: dict, batch_size: int = 1000):
+    """Store remote entries of a source, index them and count them. 
+
+    Entries are in the hash "remote_entries:{source}", keyed by upload id. Their 
+    upload ids are also added to a set per date, "remote_entries_date:{source}:{date}", 
+    and per project and date, "remote_entries_project_date:{source}:{project}:{date}". 
+    Stats counters are kept for the source, "remote_stats:{source}", and per date, 
+    "remote_stats:{source}:{date}", see `fetch_remote_stats`. The names of the per 
+    date keys are kept in "remote_entries_index:{source}".
+
+    Each entry is stored by a Lua script, so its indexes and counters change with it.
+    Storing an entry that is already there replaces it, and its counts. While an 
+    expiry is set by `expire_remote_entries`, the keys written get the same expiry.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        entries (dict): Remote entries by upload id
+        batch_size (int, optional): Entries per pipelined batch. Defaults to 1000.
+    """
+    store = r.register_script(_STORE_REMOTE_ENTRY_LUA)
+    keys = [f"remote_entries:{source}", f"remote_entries_index:{source}", f"remote_entries_ttl:{source}"]
+    items = list(entries.items())
+    for i in range(0, len(items), batch_size):
+        with r.pipeline(transaction=False) as pipe:
+            for upload_id, entry in items[i:i + batch_size]:
+                store(keys=keys, args=[source, upload_id, json.dumps(entry)], client=pipe)
+            pipe.execute()
+
+
+def fetch_remote_entries(r: redis.StrictRedis, source: str, upload_ids: List[str], batch_size: int = 1000) -> dict:
+    """Fetch the remote entries of a source with the given upload ids.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        upload_ids (List[str]): Upload ids to fetch
+        batch_size (int, optional): Upload ids per HMGET. Defaults to 1000.
+
+    Returns:
+        dict: Remote entries by upload id. Ids without an entry are left out.
+    """
+    upload_ids = [uid.decode("utf-8") if isinstance(uid, bytes) else uid for uid in upload_ids]
+    with r.pipeline(transaction=False) as pipe:
+        for i in range(0, len(upload_ids), batch_size):
+            pipe.hmget(f"remote_entries:{source}", upload_ids[i:i + batch_size])
+        batches = pipe.execute()
+
+    entries = {}
+    for i, values in enumerate(batches):
+        for upload_id, entry_json in zip(upload_ids[i * batch_size:(i + 1) * batch_size], values):
+            if entry_json:
+                entries[upload_id] = json.loads(entry_json)
+    return entries
+
+
+def fetch_remote_entries_for_date(r: redis.StrictRedis, source: str, date: str, project: str = None) -> dict:
+    """Fetch the remote entries of a source for one date, using the date indexes.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        date (str): Date, "YYYY-MM-DD"
+        project (str, optional): Only entries of this project. Defaults to None, any project.
+
+    Returns:
+        dict: Remote entries by upload id
+    """
+    if project is None:
+        key = f"remote_entries_date:{source}:{date}"
+    else:
+        key = f"remote_entries_project_date:{source}:{project}:{date}"
+    return fetch_remote_entries(r, source, list(r.smembers(key)))
+
+
+def delete_remote_entry(r: redis.StrictRedis, source: str, upload_id: str):
+    """Delete one remote entry of a source, and take it out of the indexes and counters.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        upload_id (str): Upload id
+    """
+    store = r.register_script(_STORE_REMOTE_ENTRY_LUA)
+    store(keys=[f"remote_entries:{source}", f"remote_entries_index:{source}", f"remote_entries_ttl:{source}"], args=[source, upload_id, ""])
+
+
+def delete_remote_entries(r: redis.StrictRedis, source: str):
+    """Delete every remote entry of a source, with its indexes and counters.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+    """
+    index_keys = list(r.smembers(f"remote_entries_index:{source}"))
+    # UNLINK frees the keys in the background.
+    r.unlink(f"remote_entries:{source}", f"remote_entries_index:{source}", f"remote_stats:{source}", 
+             f"device_manifest:{source}", *index_keys)
+
+
+def delete_remote_entries_for_date(r: redis.StrictRedis, source: str, date: str, batch_size: int = 1000):
+    """Delete the remote entries of a source for one date, with their indexes and counters.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        date (str): Date, "YYYY-MM-DD"
+        batch_size (int, optional): Entries per pipelined batch. Defaults to 1000.
+    """
+    store = r.register_script(_STORE_REMOTE_ENTRY_LUA)
+    keys = [f"remote_entries:{source}", f"remote_entries_index:{source}", f"remote_entries_ttl:{source}"]
+    upload_ids = [uid.decode("utf-8") for uid in r.smembers(f"remote_entries_date:{source}:{date}")]
+    for i in range(0, len(upload_ids), batch_size):
+        with r.pipeline(transaction=False) as pipe:
+            for upload_id in upload_ids[i:i + batch_size]:
+                store(keys=keys, args=[source, upload_id, ""], client=pipe)
+            pipe.execute()
+
+
+def expire_remote_entries(r: redis.StrictRedis, source: str, seconds: int = None):
+    """Set, or with None clear, an expiry on every remote entry key of a source.
+
+    The expiry is also recorded in "remote_entries_ttl:{source}", which expires with 
+    the entries. Keys written after this, such as by work still queued for a 
+    disconnected source, get the time that is left, see `follow_remote_entries_expiry`.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        seconds (int, optional): Time to live. Defaults to None, keep them.
+    """
+    keys = [f"remote_entries:{source}", f"remote_entries_index:{source}", f"remote_stats:{source}", f"device_manifest:{source}"]
+    keys += list(r.smembers(f"remote_entries_index:{source}"))
+    with r.pipeline(transaction=False) as pipe:
+        if seconds is None:
+            pipe.delete(f"remote_entries_ttl:{source}")
+        else:
+            pipe.set(f"remote_entries_ttl:{source}", seconds, ex=seconds)
+        for key in keys:
+            if seconds is None:
+                pipe.persist(key)
+            else:
+                pipe.expire(key, seconds)
+        pipe.execute()
+
+
+def follow_remote_entries_expiry(r: redis.StrictRedis, source: str, key: str):
+    """Give a key the expiry left on the remote entries of a source, if they have one.
+
+    For keys written outside `store_remote_entries`.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        key (str): Key to expire
+    """
+    ttl = r.pttl(f"remote_entries_ttl:{source}")
+    if ttl is not None and ttl > 0:
+        r.pexpire(key, ttl)
+
+
+def device_manifest_hash(entry: dict) -> str:
+    """Hash one file entry as sent by a device in "device_data_block".
+
+    The device computes the same hash to build its manifest digests. See docs/Devices.md.
+
+    Args:
+        entry (dict): Device entry
+
+    Returns:
+        str: sha1 hex digest of the tab separated "filename", "size", "start_time", 
+            "end_time", "md5", "robot_name" and "site". Missing values are empty.
+    """
+    fields = [entry.get(key) for key in ["filename", "size", "start_time", "end_time", "md5", "robot_name", "site"]]
+    line = "\t".join("" if value is None else str(value) for value in fields)
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()
+
+
+def manifest_digest(manifest: dict) -> str:
+    """Digest of the entries of one date, from the sums of their manifest hashes.
+
+    Each hash contributes its first 28 hex characters as four 7 character, 28 bit, 
+    numbers. The sums do not depend on the order of the entries, and are kept up to 
+    date as entries are stored and deleted.
+
+    Args:
+        manifest (dict): "count" and the sums "1" to "4", as in `fetch_remote_stats`
+
+    Returns:
+        str: sha1 hex digest of "{count}:{sum1}:{sum2}:{sum3}:{sum4}"
+    """
+    values = [manifest.get(key, 0) for key in ["count", "1", "2", "3", "4"]]
+    return hashlib.sha1(":".join(str(value) for value in values).encode("utf-8")).hexdigest()
+
+
+def fetch_manifest_digests(r: redis.StrictRedis, source: str) -> dict:
+    """Digest of each date of a device's stored manifest.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Device source name
+
+    Returns:
+        dict: digest by date, for dates that have entries
+    """
+    digests = {}
+    for name, stat in fetch_remote_stats(r, source).items():
+        if name == "total" or stat.get("manifest", {}).get("count", 0) <= 0:
+            continue
+        digests[name] = manifest_digest(stat["manifest"])
+    return digests
+
+
+def fetch_remote_stats(r: redis.StrictRedis, source: str, dates: List[str] = None) -> dict:
+    """Read the stats counters of a source.
+
+    Args:
+        r (redis.StrictRedis): Redis connection
+        source (str): Source name
+        dates (List[str], optional): Dates to read. Defaults to None, every date.
+
+    Returns:
+        dict: "total" and each date with entries, mapped to
+            - "total_size", "count", "on_server_size", "on_server_count" (int)
+            - "start_datetime", "end_datetime" (str)
+            - "datatype" (dict): per datatype "total_size", "count", "on_server_size", "on_server_count"
+            - "manifest" (dict): sums of the manifest hashes, only for device entries. See `manifest_digest`.
+    """
+    if dates is None:
+        prefix = f"remote_stats:{source}:"
+        dates = sorted(key.decode("utf-8")[len(prefix):] for key in r.smembers(f"remote_entries_index:{source}") 
+                       if key.decode("utf-8").startswith(prefix))
+    names = ["total"] + list(dates)
+
+    with r.pipeline(transaction=False) as pipe:
+        pipe.hgetall(f"remote_stats:{source}")
+        for date in dates:
+            pipe.hgetall(f"remote_stats:{source}:{date}")
+        values = pipe.execute()
+
+    rtn = {}
+    for name, raw in zip(names, values):
+        if not raw:
+            continue
+        stat = {"datatype": {}}
+        for key, value in raw.items():
+            key = key.decode("utf-8")
+            value = value.decode("utf-8")
+            if key.startswith("datatype:"):
+                # "datatype:{datatype}:{counter}", the datatype can be empty.
+                datatype, counter = key[len("datatype:"):].rsplit(":", 1)
+                stat["datatype"].setdefault(datatype, {})[counter] = int(value)
+            elif key.startswith("manifest:"):
+                stat.setdefault("manifest", {})[key[len("manifest:"):]] = int(value)
+            elif key in ("start_datetime", "end_datetime"):
+                stat[key] = value
+            else:
+                stat[key] = int(value)
+        # counters of a datatype that has no entries left.
+        stat["datatype"] = {datatype: counts for datatype, counts in stat["datatype"].items() if counts.get("count", 0) > 0}
+        rtn[name] = stat
+    return rtn
+
+
 class EmitRedirect:
     """
     An interface to emulate the SocketIO "emit" function.
@@ -0,0 +1,246 @@
+import json
+import multiprocessing
+import os
+import queue
+import re
+
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from threading import Event, Thread
+from typing import Dict, Iterator, List, Tuple
+
+from server.debug_print import debug_print
+from server.throttledEmit import RedisThrottledEmit
+
+# fields a .metadata file must have, the rest are filled in by the scan or the database.
+REQUIRED_FIELDS = ["project", "datatype", "relpath", "basename", "size", "datetime", 
+                   "start_datetime", "end_datetime", "upload_id"]
+
+def scan_directory(path: str, volume_root: str, known_mtime: int = None) -> dict:
+    """List one directory and parse the .metadata files in it.
+
+    Runs in the scanner's worker pool, so it must stay a module level function.
+
+    Args:
+        path (str): Directory to scan. Subdirectories are returned, not entered.
+        volume_root (str): Root of the volume the directory belongs to.
+        known_mtime (int, optional): mtime (ns) recorded by the last scan. If the
+            directory still has it, it is not listed again. Defaults to None.
+
+    Returns:
+        dict: 
+            - "path" (str): the directory
+            - "status" (str): "changed" or "unchanged"
+            - "mtime" (int): mtime of the directory, in ns, taken before listing it
+            - "subdirs" (List[str]): subdirectories, only when changed
+            - "entries" (List[dict]): an entry for every .metadata file that has a matching data file, only when changed
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if known_mtime is not None and mtime == known_mtime:
+        return {"path": path, "status": "unchanged", "mtime": mtime}
+
+    subdirs = []
+    sidecars = []
+    names = set()
+
+    with os.scandir(path) as it:
+        for item in it:
+            if item.is_dir() and not item.is_symlink():
+                subdirs.append(item.path)
+                continue
+            names.add(item.name)
+            if item.name.endswith(".metadata"):
+                sidecars.append(item.name)
+
+    entries = []
+    for basename in sidecars:
+        base = ".".join(basename.split(".")[:-1])
+        if base not in names:
+            continue
+
+        filename = os.path.join(path, base)
+        try:
+            with open(os.path.join(path, basename), "r") as fid:
+                entry = json.load(fid)
+        except (OSError, ValueError) as e:
+            debug_print(f"Failed to read {filename}.metadata: {e}")
+            continue
+
+        # a malformed sidecar is skipped, the rest of the directory is still read.
+        if not isinstance(entry, dict):
+            debug_print(f"Skipping {filename}.metadata: not a JSON object")
+            continue
+        missing = [key for key in REQUIRED_FIELDS if entry.get(key) is None]
+        if len(missing) > 0:
+            debug_print(f"Skipping {filename}.metadata: missing {', '.join(missing)}")
+            continue
+        try:
+            entry["date"] = entry.get("date", entry["datetime"].split(" ")[0])
+        except AttributeError as e:
+            debug_print(f"Skipping {filename}.metadata: bad datetime {e}")
+            continue
+
+        entry["localpath"] = filename
+        entry["dirroot"] = volume_root
+        entry["md5"] = entry.get("md5", "0")
+        entries.append(entry)
+
+    return {"path": path, "status": "changed", "mtime": mtime, "subdirs": sorted(subdirs), "entries": entries}
+
+
+class VolumeScanner:
+    """Walks the volumes in parallel and streams what it finds, one result per directory.
+
+    Every directory is a separate task, so separate volumes and large subtrees
+    within a volume are scanned at the same time. Results are handed to the
+    consumer through a bounded queue, so a slow consumer slows the scan down
+    instead of letting entries pile up in memory.
+
+    Given the state of a previous scan, a directory whose mtime has not changed
+    is not listed or read again, its recorded subdirectories are visited instead.
+
+    A process pool is used when possible. Daemonic processes (such as the
+    ServerWorker pool) can not have children, and fall back to threads.
+    """
+    def __init__(self, volume_map: dict, blackout: list, state: Dict[str, Tuple[int, List[str]]] = None,
+                 max_workers: int = None, queue_size: int = 1000, emit: RedisThrottledEmit = None) -> None:
+        """
+        Args:
+            volume_map (dict): Mapping of project name to complete volume path
+            blackout (list): Directories to skip. Can be a part of a directory, and will still match
+            state (Dict[str, Tuple[int, List[str]]], optional): Maps directory to the (mtime, subdirs) 
+                recorded by the previous scan. Defaults to None, scan everything.
+            max_workers (int, optional): Size of the worker pool. Defaults to the executor's default.
+            queue_size (int, optional): Most directory results waiting for the consumer. Defaults to 1000.
+            emit (RedisThrottledEmit, optional): Progress messages for the ui. Defaults to None.
+        """
+        self.m_volume_map = volume_map
+        self.m_blackout = blackout or []
+        self.m_blackout_re = self._compile_blackout(self.m_blackout)
+        self.m_state = state or {}
+        self.m_max_workers = max_workers
+        self.m_queue = queue.Queue(maxsize=queue_size)
+        self.m_emit = emit
+        self.m_stop = Event()
+        self.m_done = object()
+        # sent instead of m_done when the producer crashed, with the exception in m_error.
+        self.m_failed = object()
+        self.m_error = None
+
+    def _create_executor(self) -> Executor:
+        if multiprocessing.current_process().daemon:
+            return ThreadPoolExecutor(max_workers=self.m_max_workers)
+        # spawn, the caller is threaded and forking it is not safe.
+        return ProcessPoolExecutor(max_workers=self.m_max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @staticmethod
+    def _compile_blackout(blackout: list):
+        # one pattern for the whole list, so a directory is checked in a single pass.
+        # empty entries are dropped, they would match every path.
+        parts = sorted({b for b in blackout if b}, key=len, reverse=True)
+        if len(parts) == 0:
+            return None
+        return re.compile("|".join(re.escape(b) for b in parts))
+
+    def _blackout_match(self, path: str) -> str:
+        if self.m_blackout_re is None:
+            return None
+        match = self.m_blackout_re.search(path)
+        if match is None:
+            return None
+        return match.group(0)
+
+    def _put(self, item) -> bool:
+        while not self.m_stop.is_set():
+            try:
+                self.m_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _submit(self, executor: Executor, pending: dict, path: str, volume_root: str):
+        # checked before the directory is listed, so nothing below a blacked out directory is read.
+        skip = self._blackout_match(path)
+        if skip:
+            if self.m_emit:
+                self.m_emit.emit(f"Skipping because {path} matches {skip}")
+            return
+        known_mtime = None
+        if path in self.m_state:
+            known_mtime = self.m_state[path][0]
+        pending[executor.submit(scan_directory, path, volume_root, known_mtime)] = (path, volume_root)
+
+    def _produce(self):
+        last = self.m_done
+        try:
+            with self._create_executor() as executor:
+                pending = {}
+                for project in sorted(self.m_volume_map):
+                    volume_root = self.m_volume_map[project]
+                    debug_print((project, volume_root))
+                    self._submit(executor, pending, volume_root, volume_root)
+
+                while pending and not self.m_stop.is_set():
+                    done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, volume_root = pending.pop(future)
+                        try:
+                            result = future.result()
+                        except FileNotFoundError:
+                            # removed since its parent was listed, not reported so it is treated as gone.
+                            continue
+                        except Exception as e:
+                            # OSError, or anything else from the worker, such as a broken pool.
+                            # reported as failed, so what is below it is kept as it was.
+                            debug_print(f"Failed to scan {path}: {e!r}")
+                            self._put({"path": path, "status": "failed"})
+                            continue
+
+                        if result["status"] == "unchanged":
+                            subdirs = self.m_state[path][1]
+                        else:
+                            subdirs = result["subdirs"]
+                            if self.m_emit:
+                                self.m_emit.emit(f"Scanning {path}")
+
+                        for subdir in subdirs:
+                            self._submit(executor, pending, subdir, volume_root)
+
+                        self._put(result)
+
+                for future in pending:
+                    future.cancel()
+        except BaseException as e:
+            # the scan is incomplete, the consumer must not take it as finished.
+            debug_print(f"Scan failed: {e!r}")
+            self.m_error = e
+            last = self.m_failed
+        finally:
+            self._put(last)
+
+    def scan(self) -> Iterator[dict]:
+        """Scan every volume.
+
+        Directories that are blacked out, or below one, are not reported.
+
+        Yields:
+            dict: the result of `scan_directory` for each directory reached, in no particular 
+                order. A directory that could not be read is reported with status "failed".
+
+        Raises:
+            Exception: whatever stopped the scan before every directory was reached.
+        """
+        producer = Thread(target=self._produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self.m_queue.get()
+                if item is self.m_done:
+                    break
+                if item is self.m_failed:
+                    raise self.m_error
+                yield item
+        finally:
+            # stops the producer if the consumer gives up early.
+            self.m_stop.set()
+            producer.join()
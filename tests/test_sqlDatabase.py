@@ -0,0 +1,91 @@
+import psycopg2.extensions
+import pytest
+
+from server import sqlDatabase
+from server.sqlDatabase import Database
+
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.connection.queries.append(query)
+
+
+class FakeConnection:
+    """Stands in for a `PooledConnection`, without a server."""
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+        self.info = FakeInfo()
+        self.prepared = set()
+        self.queries = []
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(sqlDatabase.psycopg2, "connect", FakeConnection)
+    db = Database({}, [], init=False)
+    yield db
+    db.close()
+
+
+def test_pool_keeps_idle_connections(database):
+    database.m_pool_max = 3
+    with database._connection() as a, database._connection() as b, database._connection() as c:
+        pass
+
+    pool, _ = database._get_pool()
+    assert not (a.closed or b.closed or c.closed)
+    assert len(pool._pool) == 3
+
+    # borrowed again rather than opened
+    with database._connection() as conn:
+        assert conn in (a, b, c)
+
+
+def test_closed_connections_are_forgotten(database):
+    with database._connection() as conn:
+        conn.close()
+    assert id(conn) not in database.m_last_used
+
+
+def test_recycled_connection_prepares_again(database):
+    query = "SELECT * FROM data WHERE upload_id = %s"
+
+    with database._connection() as conn:
+        with conn.cursor() as cur:
+            database._execute_prepared(cur, query, ["a"])
+            database._execute_prepared(cur, query, ["b"])
+        conn.close()
+    assert sum(q.startswith("PREPARE") for q in conn.queries) == 1
+
+    # whatever its id, the new connection has nothing prepared yet.
+    with database._connection() as fresh:
+        with fresh.cursor() as cur:
+            database._execute_prepared(cur, query, ["c"])
+    statements = [q.split(" ")[0] for q in fresh.queries if q.startswith(("PREPARE", "EXECUTE"))]
+    assert fresh is not conn
+    assert statements == ["PREPARE", "EXECUTE"]